@@ -3,7 +3,7 @@ from django.db.models import Prefetch
 from .models import (
     DrugCategory, Drug, Supplier, Order, 
     OrderItem, Transaction, Inventory, 
-    PriceHistory, Notifications
+    PriceHistory, Notifications, EmailOutbox, StockLot
 )
 
 class DrugCategoryAdmin(admin.ModelAdmin):
@@ -83,6 +83,16 @@ class TransactionAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('drug')
 
+    # Recorded through the API only, which moves stock along with them
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 class InventoryAdmin(admin.ModelAdmin):
     list_display = ('drug', 'quantity', 'reorder_level', 'last_updated')
     list_filter = ('last_updated',)
@@ -90,6 +100,33 @@ class InventoryAdmin(admin.ModelAdmin):
     ordering = ('drug__name',)
     list_select_related = ('drug',)
 
+class StockLotAdmin(admin.ModelAdmin):
+    list_display = ('drug', 'lot_number', 'expiry_date', 'quantity', 'received_at')
+    list_filter = ('expiry_date',)
+    search_fields = ('drug__name', 'drug__SKU', 'lot_number')
+    ordering = ('expiry_date', 'id')
+    list_select_related = ('drug',)
+    actions = ['write_off_expired']
+
+    # Lots follow receipts and sales; expired ones leave through the action
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description="Write off the expired lots among those selected")
+    def write_off_expired(self, request, queryset):
+        transactions = StockLot.write_off_expired(queryset)
+        self.message_user(
+            request,
+            f"Wrote off {sum(item.quantity for item in transactions)} expired "
+            f"unit(s) of {len(transactions)} drug(s)"
+        )
+
 class NotificationsAdmin(admin.ModelAdmin):
     list_display = ('drug', 'notification_type', 'created_at', 'is_read')
     list_filter = ('notification_type', 'is_read', 'created_at')
@@ -98,6 +135,13 @@ class NotificationsAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at']
     list_select_related = ('drug',)
 
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipient', 'created_at', 'sent_at', 'attempts')
+    list_filter = ('sent_at',)
+    search_fields = ('recipient', 'subject')
+    ordering = ('-created_at',)
+    readonly_fields = ['created_at']
+
 # Register all models
 admin.site.register(DrugCategory, DrugCategoryAdmin)
 admin.site.register(Drug, DrugAdmin)
@@ -107,3 +151,5 @@ admin.site.register(Transaction, TransactionAdmin)
 admin.site.register(Inventory, InventoryAdmin)
 admin.site.register(Notifications, NotificationsAdmin)
 admin.site.register(PriceHistory)
+admin.site.register(EmailOutbox, EmailOutboxAdmin)
+admin.site.register(StockLot, StockLotAdmin)
@@ -0,0 +1,128 @@
+"""
+Async read endpoints for the ASGI entry point (``myapp/asgi.py``).
+
+DRF views are synchronous, so under ASGI every request to them holds a
+thread-pool slot until it finishes. These views serve the read-heavy
+screens with Django's async ORM instead: while a query or a slow client is
+pending, the worker's event loop serves other requests. Payloads match the
+corresponding DRF endpoints, because the same serializers render rows that
+are already fully loaded.
+"""
+import base64
+import binascii
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate
+from django.db.models import F
+from django.http import JsonResponse
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from .dashboard import get_dashboard
+from .models import Inventory, Notifications
+from .serializers import InventorySerializer, NotificationsSerializer
+
+UNREAD_NOTIFICATIONS_LIMIT = 100
+
+async def authenticated_user(request):
+    """Async equivalent of the session and basic authentication DRF uses."""
+    user = await request.auser()
+    if user.is_authenticated:
+        return user
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'basic':
+        return None
+    try:
+        username, _, password = base64.b64decode(auth[1]).decode().partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return await aauthenticate(request, username=username, password=password)
+
+def async_login_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        request.user = await authenticated_user(request)
+        if request.user is None:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=403
+            )
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+async def serialize(serializer_class, queryset):
+    rows = [row async for row in queryset.aiterator()]
+    return serializer_class(rows, many=True).data
+
+@async_login_required
+async def inventory_list(request):
+    queryset = Inventory.objects.order_by('id')
+    drug = request.GET.get('drug')
+    if drug:
+        try:
+            queryset = queryset.filter(drug_id=int(drug))
+        except ValueError:
+            return JsonResponse({"error": "drug must be an integer"}, status=400)
+    ordering = request.GET.get('ordering', '')
+    if ordering.lstrip('-') in ('quantity', 'last_updated'):
+        queryset = queryset.order_by(ordering, 'id')
+
+    page_size = api_settings.PAGE_SIZE
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return JsonResponse({"detail": "Invalid page."}, status=404)
+    count = await queryset.acount()
+    offset = (page - 1) * page_size
+    if offset and offset >= count:
+        return JsonResponse({"detail": "Invalid page."}, status=404)
+
+    url = request.build_absolute_uri()
+    previous = None
+    if page > 2:
+        previous = replace_query_param(url, 'page', page - 1)
+    elif page == 2:
+        previous = remove_query_param(url, 'page')
+    return JsonResponse({
+        'count': count,
+        'next': (
+            replace_query_param(url, 'page', page + 1)
+            if offset + page_size < count else None
+        ),
+        'previous': previous,
+        'results': await serialize(
+            InventorySerializer, queryset[offset:offset + page_size]
+        ),
+    })
+
+@async_login_required
+async def inventory_detail(request, pk):
+    try:
+        inventory = await Inventory.objects.aget(pk=pk)
+    except Inventory.DoesNotExist:
+        return JsonResponse({"detail": "Not found."}, status=404)
+    return JsonResponse(InventorySerializer(inventory).data)
+
+@async_login_required
+async def low_stock(request):
+    queryset = Inventory.objects.filter(quantity__lte=F('reorder_level'))
+    return JsonResponse(
+        await serialize(InventorySerializer, queryset), safe=False
+    )
+
+@async_login_required
+async def unread_notifications(request):
+    queryset = Notifications.objects.filter(is_read=False)
+    return JsonResponse({
+        'count': await queryset.acount(),
+        'results': await serialize(
+            NotificationsSerializer,
+            queryset.select_related('drug').order_by(
+                '-created_at', '-id'
+            )[:UNREAD_NOTIFICATIONS_LIMIT]
+        ),
+    })
+
+@async_login_required
+async def dashboard(request):
+    # Almost always a cache hit; the rare recomputation runs on the ORM thread
+    return JsonResponse(await sync_to_async(get_dashboard)())
@@ -0,0 +1,133 @@
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+from .models import Drug, Inventory
+
+INDEX_VERSION_KEY = 'inventory:drug-prefix-index:version'
+
+# Backends whose incr() is a single atomic operation. DatabaseCache and
+# FileBasedCache read and then write, so two processes can both move the
+# counter to the same value
+ATOMIC_INCR_BACKENDS = (RedisCache, BaseMemcachedCache, LocMemCache)
+
+class DrugPrefixIndex:
+    """
+    Per-process prefix index over drug SKUs, names and the words of names.
+
+    Terms are kept in one sorted list of (term, drug id) pairs and searched
+    with bisect, so a lookup costs O(log n) plus the matches returned.
+    Every committed drug change, in any process, increments a counter in the
+    shared cache. The process that made the change patches its index in
+    place; any other process sees a counter it has not caught up with, and
+    its next lookup rebuilds the index from one query. Patching relies on an
+    atomic incr(); with any other cache backend the process that made the
+    change rebuilds as well.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.terms = []
+        self.drugs = {}
+        self.version = None
+
+    @staticmethod
+    def terms_for(sku, name):
+        terms = {sku.lower(), name.lower()}
+        terms.update(re.findall(r'\w+', name.lower()))
+        return terms
+
+    def rebuild(self):
+        drugs = {
+            drug_id: (sku, name)
+            for drug_id, sku, name in Drug.objects.values_list('id', 'SKU', 'name')
+        }
+        terms = sorted(
+            (term, drug_id)
+            for drug_id, (sku, name) in drugs.items()
+            for term in self.terms_for(sku, name)
+        )
+        self.drugs, self.terms = drugs, terms
+
+    @staticmethod
+    def shared_version():
+        version = cache.get(INDEX_VERSION_KEY)
+        if version is None:
+            # Start from the clock so an evicted counter never comes back to
+            # a value some process's index is already marked with
+            cache.add(INDEX_VERSION_KEY, time.time_ns(), None)
+            version = cache.get(INDEX_VERSION_KEY)
+        return version
+
+    def ensure_current(self):
+        # Read before the rebuild: a change committed meanwhile moves the
+        # counter past it and triggers another rebuild
+        version = self.shared_version()
+        if version != self.version:
+            self.rebuild()
+            self.version = version
+
+    def _remove(self, drug_id):
+        sku, name = self.drugs.pop(drug_id, (None, None))
+        if sku is None:
+            return
+        for term in self.terms_for(sku, name):
+            position = bisect_left(self.terms, (term, drug_id))
+            if position < len(self.terms) and self.terms[position] == (term, drug_id):
+                del self.terms[position]
+
+    def committed(self, drug_id, sku=None, name=None):
+        """
+        Apply a committed change to a drug, a deletion when ``sku`` is None,
+        and advance the shared counter. The patched index is only marked
+        current when the counter moved by exactly this change; if another
+        process changed a drug in between, or the cache cannot tell because
+        its incr() is not atomic, the next lookup rebuilds instead.
+        """
+        with self.lock:
+            try:
+                version = cache.incr(INDEX_VERSION_KEY)
+            except ValueError:
+                version = None
+            atomic = isinstance(caches[DEFAULT_CACHE_ALIAS], ATOMIC_INCR_BACKENDS)
+            if not atomic or self.version is None or version != self.version + 1:
+                self.version = None
+                return
+            self._remove(drug_id)
+            if sku is not None:
+                self.drugs[drug_id] = (sku, name)
+                for term in self.terms_for(sku, name):
+                    insort(self.terms, (term, drug_id))
+            self.version = version
+
+    def search(self, prefix, limit=10):
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        with self.lock:
+            self.ensure_current()
+            matches = []
+            position = bisect_left(self.terms, (prefix,))
+            while position < len(self.terms) and len(matches) < limit:
+                term, drug_id = self.terms[position]
+                if not term.startswith(prefix):
+                    break
+                if drug_id not in matches:
+                    matches.append(drug_id)
+                position += 1
+            drugs = [(drug_id, *self.drugs[drug_id]) for drug_id in matches]
+
+        stock = dict(
+            Inventory.objects.filter(drug_id__in=matches)
+            .values_list('drug_id', 'quantity')
+        )
+        return [
+            {'id': drug_id, 'SKU': sku, 'name': name, 'stock': stock.get(drug_id)}
+            for drug_id, sku, name in drugs
+        ]
+
+drug_prefix_index = DrugPrefixIndex()
@@ -0,0 +1,129 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+MODEL_VERSION_KEY = 'inventory:model-version:{}'
+RESPONSE_KEY = 'inventory:response:{}'
+# Longest a single recomputation may hold the lock of a cached value
+RECOMPUTE_LOCK_TIMEOUT = 30
+
+def model_versions(models):
+    """Current version stamp of each model, joined into one string."""
+    keys = [MODEL_VERSION_KEY.format(model._meta.label_lower) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Start from the clock rather than 1 so an evicted counter can
+            # never come back to a value an old cached response was keyed on
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return '.'.join(str(versions[key]) for key in keys)
+
+def increment_model_versions(models):
+    for model in models:
+        key = MODEL_VERSION_KEY.format(model._meta.label_lower)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+def bump_model_version(*models):
+    """
+    Invalidate every cached response built from ``models``. Inside a
+    transaction the versions are bumped again on commit, so a response that
+    a concurrent request cached from pre-commit data is dropped as well.
+    """
+    increment_model_versions(models)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: increment_model_versions(models))
+
+def update_and_bump(queryset, **values):
+    """
+    ``queryset.update(**values)`` that also invalidates the cached responses
+    of its model: update() sends no post_save, so the signal handlers that
+    normally bump the version never run. Returns the number of rows updated.
+    """
+    updated = queryset.update(**values)
+    if updated:
+        bump_model_version(queryset.model)
+    return updated
+
+def get_or_recompute(key, compute, timeout):
+    """
+    Return the value cached under ``key``, letting only one caller at a time
+    run ``compute`` when it is missing or older than ``timeout`` seconds.
+
+    Values are kept for twice ``timeout``; while one caller recomputes, the
+    others get the stale value instead of piling onto the database. Callers
+    arriving before any value exists wait for the one computing it.
+    """
+    entry = cache.get(key)
+    if entry is not None and entry[1] > time.time():
+        return entry[0]
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, RECOMPUTE_LOCK_TIMEOUT):
+        try:
+            value = compute()
+            cache.set(key, (value, time.time() + timeout), timeout * 2)
+        finally:
+            cache.delete(lock_key)
+        return value
+    if entry is not None:
+        return entry[0]
+
+    deadline = time.monotonic() + RECOMPUTE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    return compute()
+
+class VersionedResponseCacheMixin:
+    """
+    Caches list and retrieve responses under the current version of every
+    model in ``cache_models`` plus the full request path, and tags them with
+    a strong ETag derived from the same inputs. A client presenting a
+    matching If-None-Match gets 304 Not Modified before any query runs.
+    """
+    cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        fingerprint = hashlib.sha256('|'.join([
+            self.basename,
+            self.action,
+            request.get_full_path(),
+            request.accepted_renderer.format,
+            model_versions(self.cache_models),
+        ]).encode()).hexdigest()
+        etag = f'"{fingerprint}"'
+
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+
+        key = RESPONSE_KEY.format(fingerprint)
+        data = cache.get(key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
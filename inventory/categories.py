@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.cache import cache
+from .models import DrugCategory
+
+CATEGORY_TREE_CACHE_KEY = 'inventory:drug-category-tree'
+
+def build_category_nodes():
+    """
+    Load every DrugCategory in one query and link them through a
+    parent -> children map. Returns a dict of category id -> node, where each
+    node is the serialized category with its nested ``subcategories``.
+    """
+    nodes = {
+        category['id']: {**category, 'subcategories': []}
+        for category in DrugCategory.objects.order_by('name').values(
+            'id', 'name', 'description', 'parent_category'
+        )
+    }
+    for node in nodes.values():
+        parent = nodes.get(node['parent_category'])
+        if parent is not None:
+            parent['subcategories'].append(node)
+    return nodes
+
+def get_category_nodes():
+    nodes = cache.get(CATEGORY_TREE_CACHE_KEY)
+    if nodes is None:
+        nodes = build_category_nodes()
+        cache.set(CATEGORY_TREE_CACHE_KEY, nodes, settings.CATEGORY_TREE_CACHE_TIMEOUT)
+    return nodes
+
+def get_category_tree():
+    """Return the root categories with their full nested subtrees."""
+    return [
+        node for node in get_category_nodes().values()
+        if node['parent_category'] is None
+    ]
+
+def invalidate_category_tree():
+    cache.delete(CATEGORY_TREE_CACHE_KEY)
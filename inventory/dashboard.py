@@ -0,0 +1,62 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.utils.timezone import now
+from .cache import get_or_recompute
+from .models import (
+    Inventory, Notifications, Order, PriceHistory, TransactionRollup
+)
+
+DASHBOARD_CACHE_KEY = 'inventory:dashboard'
+SALES_WINDOW = timedelta(days=30)
+
+def money(value):
+    return str((value or Decimal('0')).quantize(Decimal('0.01')))
+
+def compute_dashboard():
+    """Home screen figures in four aggregate queries."""
+    latest_price = PriceHistory.objects.filter(
+        drug=OuterRef('drug')
+    ).order_by('-time_created', '-id').values('purchase_price')[:1]
+    stock = Inventory.objects.aggregate(
+        total_stock_value=Sum(F('quantity') * Subquery(latest_price)),
+        low_stock_count=Count('id', filter=Q(quantity__lte=F('reorder_level'))),
+    )
+
+    open_orders = dict(
+        Order.objects.exclude(status='RECEIVED')
+        .values_list('status')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+
+    # Hourly rollups cover the window without reading the transactions table
+    generated_at = now()
+    sales = TransactionRollup.objects.filter(
+        granularity='HOUR',
+        transaction_type='SALE',
+        period_start__gte=TransactionRollup.period_start_for(
+            generated_at - SALES_WINDOW, 'HOUR'
+        ),
+    ).aggregate(revenue=Sum('revenue'), quantity=Sum('quantity'))
+
+    return {
+        'total_stock_value': money(stock['total_stock_value']),
+        'low_stock_count': stock['low_stock_count'],
+        'open_orders': {
+            status: open_orders.get(status, 0)
+            for status, _ in Order.STATUS_CHOICES if status != 'RECEIVED'
+        },
+        'sales_last_30_days': {
+            'revenue': money(sales['revenue']),
+            'quantity': sales['quantity'] or 0,
+        },
+        'unread_notifications': Notifications.objects.filter(is_read=False).count(),
+        'generated_at': generated_at.isoformat(),
+    }
+
+def get_dashboard():
+    return get_or_recompute(
+        DASHBOARD_CACHE_KEY, compute_dashboard, settings.DASHBOARD_CACHE_TIMEOUT
+    )
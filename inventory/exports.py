@@ -0,0 +1,111 @@
+import csv
+import json
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+
+class Echo:
+    """File-like object whose write() hands the line back to csv.writer."""
+
+    def write(self, value):
+        return value
+
+class CSVExportRenderer(BaseRenderer):
+    """
+    Lets content negotiation accept ``?format=csv``. Exports are streamed by
+    StreamingExportMixin; this only renders the small non-streamed
+    responses, such as validation errors.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        rows = [row for row in rows if isinstance(row, dict)]
+        if not rows:
+            return b''
+        writer = csv.writer(Echo())
+        lines = [writer.writerow(list(rows[0]))]
+        lines += [writer.writerow(list(row.values())) for row in rows]
+        return ''.join(lines).encode()
+
+class NDJSONExportRenderer(BaseRenderer):
+    """Newline-delimited JSON counterpart of CSVExportRenderer."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(
+            json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows
+        ).encode()
+
+EXPORT_RENDERERS = {
+    renderer.format: renderer
+    for renderer in (CSVExportRenderer, NDJSONExportRenderer)
+}
+
+def stream_export(queryset, columns, export_format, filename):
+    """
+    Stream ``queryset`` as CSV or NDJSON. ``columns`` is a list of
+    (header, lookup) pairs; rows are read as plain tuples in chunks with
+    QuerySet.iterator(), so memory stays flat whatever the size of the export.
+    """
+    headers = [header for header, _ in columns]
+    rows = queryset.prefetch_related(None).values_list(
+        *[lookup for _, lookup in columns]
+    ).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+        content = (
+            writer.writerow(row)
+            for stream in ([headers], rows)
+            for row in stream
+        )
+    else:
+        content = (
+            json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder) + '\n'
+            for row in rows
+        )
+
+    renderer = EXPORT_RENDERERS[export_format]
+    response = StreamingHttpResponse(content, content_type=renderer.media_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename="{filename}.{export_format}"'
+    )
+    return response
+
+class StreamingExportMixin:
+    """
+    Adds ``?format=csv`` and ``?format=ndjson`` to a viewset. The list
+    endpoint then streams every filtered row instead of returning a page.
+    """
+    renderer_classes = [
+        *api_settings.DEFAULT_RENDERER_CLASSES,
+        *EXPORT_RENDERERS.values(),
+    ]
+    export_columns = []
+    export_ordering = ('time_created', 'id')
+
+    def is_export(self, request):
+        return request.accepted_renderer.format in EXPORT_RENDERERS
+
+    def export(self, request, queryset):
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by(*self.export_ordering)
+        return stream_export(
+            queryset,
+            self.export_columns,
+            request.accepted_renderer.format,
+            self.basename
+        )
+
+    def list(self, request, *args, **kwargs):
+        if self.is_export(request):
+            return self.export(
+                request, self.filter_queryset(self.get_queryset())
+            )
+        return super().list(request, *args, **kwargs)
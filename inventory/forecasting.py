@@ -0,0 +1,120 @@
+"""
+Catalog-wide demand forecasting and safety-stock reorder levels.
+
+Daily demand (sales plus usage) comes from the DAY transaction rollups and
+is laid out as one drugs x days NumPy matrix, so every forecast is a handful
+of array operations over the whole catalog.
+"""
+import math
+from datetime import timedelta
+from statistics import NormalDist
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import localtime, now
+from .cache import update_and_bump
+from .models import Inventory, TransactionRollup
+
+METHODS = ('moving_average', 'exponential')
+
+def daily_demand(history_days):
+    """
+    Units consumed per drug per day over the last ``history_days`` complete
+    days. Returns the drug ids and a matrix with one row per drug.
+    """
+    today = TransactionRollup.period_start_for(now(), 'DAY')
+    start = today - timedelta(days=history_days)
+    rows = list(
+        TransactionRollup.objects.filter(
+            granularity='DAY', period_start__gte=start, period_start__lt=today,
+            transaction_type__in=['SALE', 'USAGE']
+        ).values_list('drug_id', 'period_start', 'quantity')
+    )
+    drugs = np.fromiter((row[0] for row in rows), np.int64, len(rows))
+    days = np.fromiter(
+        ((localtime(row[1]).date() - start.date()).days for row in rows),
+        np.int64, len(rows)
+    )
+    quantities = np.fromiter((row[2] for row in rows), np.float64, len(rows))
+
+    drug_ids, row_index = np.unique(drugs, return_inverse=True)
+    demand = np.zeros((len(drug_ids), history_days))
+    # Sales and usage of the same day land in the same cell
+    np.add.at(demand, (row_index, days), quantities)
+    return drug_ids, demand
+
+def forecast(demand, method='moving_average', window=28, alpha=0.3):
+    """
+    Expected daily demand and its standard deviation for every row of
+    ``demand``, either over the last ``window`` days or by exponential
+    smoothing with factor ``alpha``.
+    """
+    if method == 'moving_average':
+        recent = demand[:, -window:]
+        return recent.mean(axis=1), recent.std(axis=1)
+
+    level = demand[:, 0].copy()
+    variance = np.zeros(len(demand))
+    # One vector step per day, across the whole catalog
+    for day in demand.T[1:]:
+        error = day - level
+        level += alpha * error
+        variance = (1 - alpha) * (variance + alpha * error ** 2)
+    return level, np.sqrt(variance)
+
+def recommend_reorder_levels(
+    method='moving_average', history_days=90, window=28, alpha=0.3,
+    lead_time_days=None, service_level=None
+):
+    """
+    Reorder level per drug that covers expected demand over the supplier
+    lead time plus safety stock for ``service_level``. Drugs without any
+    demand in the history window get no recommendation.
+    """
+    if lead_time_days is None:
+        lead_time_days = settings.REORDER_LEAD_TIME_DAYS
+    if service_level is None:
+        service_level = settings.REORDER_SERVICE_LEVEL
+
+    drug_ids, demand = daily_demand(history_days)
+    expected, deviation = forecast(demand, method, window, alpha)
+    z = NormalDist().inv_cdf(service_level)
+    levels = np.ceil(
+        expected * lead_time_days + z * deviation * math.sqrt(lead_time_days)
+    ).astype(np.int64)
+
+    current = dict(Inventory.objects.values_list('drug_id', 'reorder_level'))
+    return [
+        {
+            'drug': drug_id,
+            'current_reorder_level': current[drug_id],
+            'proposed_reorder_level': level,
+            'daily_demand': round(daily, 3),
+            'demand_deviation': round(spread, 3),
+        }
+        for drug_id, level, daily, spread in zip(
+            drug_ids.tolist(), levels.tolist(), expected.tolist(), deviation.tolist()
+        )
+        if drug_id in current
+    ]
+
+def apply_reorder_levels(recommendations, batch_size=2000):
+    """
+    Write the proposed levels back with one set-based UPDATE per
+    ``batch_size`` changed rows, which keeps each statement within the
+    database's parameter limit.
+    """
+    changed = [
+        (row['drug'], row['proposed_reorder_level']) for row in recommendations
+        if row['proposed_reorder_level'] != row['current_reorder_level']
+    ]
+    updated = 0
+    with transaction.atomic():
+        for start in range(0, len(changed), batch_size):
+            batch = dict(changed[start:start + batch_size])
+            updated += update_and_bump(
+                Inventory.objects.filter(drug_id__in=batch),
+                reorder_level=Inventory.per_drug(batch),
+                last_updated=now()
+            )
+    return updated
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from inventory.management.commands.benchmark_endpoints import percentile
+
+# Each sync DRF endpoint and the async endpoint that serves the same read
+ENDPOINT_PAIRS = [
+    ('/api/inventory/', '/api/async/inventory/'),
+    ('/api/inventory/low_stock/', '/api/async/inventory/low_stock/'),
+    ('/api/notifications/?is_read=False', '/api/async/notifications/unread/'),
+    ('/api/dashboard/', '/api/async/dashboard/'),
+]
+
+def summary(timings, elapsed, statuses):
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'statuses': sorted(set(statuses)),
+    }
+
+class Command(BaseCommand):
+    help = (
+        "Compare the throughput of the WSGI application in myapp/wsgi.py with "
+        "the async endpoints served by myapp/asgi.py, for many concurrent "
+        "slow clients, in-process"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument(
+            '--clients', type=int, default=100,
+            help="Concurrent clients kept in flight against the ASGI application"
+        )
+        parser.add_argument(
+            '--threads', type=int, default=8,
+            help="Worker threads serving the WSGI application"
+        )
+        parser.add_argument(
+            '--client-delay', type=float, default=0.25,
+            help="Seconds each client takes to receive a response"
+        )
+        parser.add_argument(
+            '--username',
+            help="Existing user to authenticate as; defaults to the first active user"
+        )
+        parser.add_argument(
+            '--output',
+            help="Write the JSON report to this file instead of stdout"
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(is_active=True).order_by('pk')
+        if options['username']:
+            users = users.filter(username=options['username'])
+        user = users.first()
+        if user is None:
+            raise CommandError("No active user to authenticate the benchmark with")
+
+        # A real session, so both stacks run their normal authentication
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+        from myapp.asgi import application as asgi_application
+        from myapp.wsgi import application as wsgi_application
+        results = []
+        try:
+            for wsgi_path, asgi_path in ENDPOINT_PAIRS:
+                results.append({
+                    'wsgi': {
+                        'endpoint': wsgi_path,
+                        **self.run_wsgi(wsgi_application, wsgi_path, options),
+                    },
+                    'asgi': {
+                        'endpoint': asgi_path,
+                        **asyncio.run(
+                            self.run_asgi(asgi_application, asgi_path, options)
+                        ),
+                    },
+                })
+        finally:
+            session.delete()
+
+        report = json.dumps({
+            'requests': options['requests'],
+            'clients': options['clients'],
+            'wsgi_threads': options['threads'],
+            'client_delay_seconds': options['client_delay'],
+            'database': connection.vendor,
+            'endpoints': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def run_wsgi(self, application, url, options):
+        path, _, query = url.partition('?')
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': 'localhost',
+            'HTTP_COOKIE': self.cookie,
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+
+        def request(_):
+            started = time.perf_counter()
+            statuses = []
+            response = application(
+                {**environ, 'wsgi.input': BytesIO()},
+                lambda status, headers, exc_info=None: statuses.append(status)
+            )
+            try:
+                for _chunk in response:
+                    # A worker thread stays blocked while a slow client reads
+                    time.sleep(options['client_delay'])
+            finally:
+                response.close()
+            return (time.perf_counter() - started) * 1000, int(statuses[0][:3])
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            outcomes = list(pool.map(request, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        return summary(
+            [timing for timing, _ in outcomes], elapsed,
+            [code for _, code in outcomes]
+        )
+
+    async def run_asgi(self, application, url, options):
+        path, _, query = url.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': [
+                (b'host', b'localhost'),
+                (b'cookie', self.cookie.encode()),
+            ],
+            'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }
+        pending = iter(range(options['requests']))
+        timings, statuses = [], []
+
+        async def request():
+            received = False
+
+            async def receive():
+                nonlocal received
+                if not received:
+                    received = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # The client never disconnects; Django cancels this when done
+                await asyncio.Future()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                elif message['type'] == 'http.response.body':
+                    # A slow client only delays this coroutine, not the worker
+                    await asyncio.sleep(options['client_delay'])
+
+            started = time.perf_counter()
+            await application(dict(scope), receive, send)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        async def client():
+            for _ in pending:
+                await request()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(options['clients'])))
+        return summary(timings, time.perf_counter() - started, statuses)
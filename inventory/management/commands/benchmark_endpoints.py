@@ -0,0 +1,117 @@
+import json
+import math
+import time
+from urllib.parse import urlencode
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+from inventory.urls import router
+
+def percentile(samples, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return None
+    rank = max(math.ceil(percent / 100 * len(samples)), 1)
+    return samples[rank - 1]
+
+def default_params():
+    """Query parameters for the actions that refuse to run without them."""
+    today = now()
+    return {
+        'transaction-by-date-range': {
+            'start_date': (today - timedelta(days=30)).isoformat(),
+            'end_date': today.isoformat(),
+        },
+        'inventory-as-of': {
+            't': (today - timedelta(days=7)).isoformat(),
+        },
+    }
+
+class Command(BaseCommand):
+    help = (
+        "Drive every GET endpoint of the inventory API router in-process and "
+        "report latency percentiles, SQL query counts and response sizes as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument(
+            '--output',
+            help="Write the JSON report to this file instead of stdout"
+        )
+
+    def handle(self, *args, **options):
+        client = APIClient(HTTP_HOST='localhost')
+        # An unsaved user is enough for IsAuthenticated and writes nothing
+        client.force_authenticate(User(username='benchmark'))
+
+        results = []
+        for url in self.endpoints():
+            for _ in range(options['warmup']):
+                client.get(url)
+            timings, queries, query_ms = [], [], []
+            for _ in range(options['iterations']):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    body = (
+                        b''.join(response.streaming_content)
+                        if response.streaming else response.content
+                    )
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries.append(len(captured))
+                query_ms.append(sum(
+                    float(query['time']) * 1000 for query in captured.captured_queries
+                ))
+            timings.sort()
+            results.append({
+                'endpoint': url,
+                'status': response.status_code,
+                'p50_ms': round(percentile(timings, 50), 3),
+                'p95_ms': round(percentile(timings, 95), 3),
+                'p99_ms': round(percentile(timings, 99), 3),
+                'queries': max(queries),
+                'query_ms': round(sorted(query_ms)[len(query_ms) // 2], 3),
+                'response_bytes': len(body),
+            })
+
+        report = json.dumps({
+            'iterations': options['iterations'],
+            'database': connection.vendor,
+            'endpoints': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def endpoints(self):
+        """List, detail and GET action URLs for every registered viewset."""
+        params = default_params()
+        for prefix, viewset, basename in router.registry:
+            sample = viewset(action='list', request=None, format_kwarg=None)
+            instance = sample.get_queryset().order_by('pk').first()
+            yield reverse(f'{basename}-list')
+            if instance is not None:
+                yield reverse(f'{basename}-detail', kwargs={'pk': instance.pk})
+            for extra_action in viewset.get_extra_actions():
+                if 'get' not in extra_action.mapping:
+                    continue
+                name = f'{basename}-{extra_action.url_name}'
+                if extra_action.detail:
+                    if instance is None:
+                        continue
+                    url = reverse(name, kwargs={'pk': instance.pk})
+                else:
+                    url = reverse(name)
+                query = params.get(name)
+                if query:
+                    url += '?' + urlencode(query)
+                yield url
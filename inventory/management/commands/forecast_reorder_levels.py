@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from inventory.forecasting import (
+    METHODS, apply_reorder_levels, recommend_reorder_levels
+)
+
+class Command(BaseCommand):
+    help = (
+        "Forecast daily demand for the whole catalog and set every drug's "
+        "reorder level to cover lead-time demand plus safety stock; run nightly"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--method', choices=METHODS, default='moving_average')
+        parser.add_argument('--history-days', type=int, default=90)
+        parser.add_argument(
+            '--window', type=int, default=28,
+            help="Days averaged by the moving_average method"
+        )
+        parser.add_argument(
+            '--alpha', type=float, default=0.3,
+            help="Smoothing factor of the exponential method"
+        )
+        parser.add_argument(
+            '--lead-time-days', type=int, default=settings.REORDER_LEAD_TIME_DAYS
+        )
+        parser.add_argument(
+            '--service-level', type=float, default=settings.REORDER_SERVICE_LEVEL
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Report the changes without saving them"
+        )
+
+    def handle(self, *args, **options):
+        recommendations = recommend_reorder_levels(
+            method=options['method'],
+            history_days=options['history_days'],
+            window=options['window'],
+            alpha=options['alpha'],
+            lead_time_days=options['lead_time_days'],
+            service_level=options['service_level'],
+        )
+        changed = sum(
+            1 for row in recommendations
+            if row['proposed_reorder_level'] != row['current_reorder_level']
+        )
+        if options['dry_run']:
+            self.stdout.write(
+                f"{changed} of {len(recommendations)} forecast reorder level(s) would change"
+            )
+            return
+        updated = apply_reorder_levels(recommendations)
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {updated} of {len(recommendations)} forecast reorder level(s)"
+        ))
@@ -0,0 +1,241 @@
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.timezone import get_current_timezone
+from inventory.models import (
+    DrugCategory, Drug, Supplier, Order, OrderItem,
+    Transaction, Inventory, PriceHistory, Notifications
+)
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let bulk_create keep the generated time_created/created_at values."""
+    fields = [
+        field for model in models for field in model._meta.fields
+        if getattr(field, 'auto_now_add', False)
+    ]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+class Command(BaseCommand):
+    help = (
+        "Deterministically generate a production-sized synthetic data set "
+        "with bulk inserts. The same --seed and --end-date give the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--categories', type=int, default=200)
+        parser.add_argument('--category-depth', type=int, default=5)
+        parser.add_argument('--suppliers', type=int, default=50)
+        parser.add_argument('--drugs', type=int, default=1000)
+        parser.add_argument('--price-history', type=int, default=10000)
+        parser.add_argument('--transactions', type=int, default=100000)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--max-order-lines', type=int, default=20)
+        parser.add_argument('--notifications', type=int, default=1000)
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help="Spread timestamps over this many days before --end-date"
+        )
+        parser.add_argument(
+            '--end-date',
+            type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+            default=None,
+            help="Last day of generated history (YYYY-MM-DD), defaults to today"
+        )
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = f"GEN{options['seed']}"
+        end_date = options['end_date'] or datetime.now().date()
+        self.end = datetime.combine(
+            end_date, time(23, 59, 59), tzinfo=get_current_timezone()
+        )
+        self.span_seconds = options['days'] * 86400
+
+        with transaction.atomic(), explicit_timestamps(
+            Supplier, Order, Transaction, PriceHistory, Notifications, Inventory
+        ):
+            category_ids = self.create_categories(
+                options['categories'], options['category_depth']
+            )
+            supplier_ids = self.create_suppliers(options['suppliers'])
+            drug_ids = self.create_drugs(options['drugs'], category_ids)
+            self.create_inventory(drug_ids)
+            self.create_price_history(options['price_history'], drug_ids)
+            self.create_transactions(options['transactions'], drug_ids)
+            self.create_orders(
+                options['orders'], options['max_order_lines'],
+                supplier_ids, drug_ids
+            )
+            self.create_notifications(options['notifications'], drug_ids)
+
+        call_command('rebuild_transaction_rollups', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS("Synthetic data generated"))
+
+    def timestamp(self):
+        return self.end - timedelta(seconds=self.rng.randrange(self.span_seconds))
+
+    def price(self, low, high):
+        return Decimal(self.rng.randrange(low * 100, high * 100)) / 100
+
+    def insert(self, model, rows, return_ids=False):
+        """
+        bulk_create a generator of unsaved instances in batches. Primary keys
+        are only collected when asked for, so the big tables stream through
+        without being held in memory.
+        """
+        ids, batch, total = [], [], 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                created = model.objects.bulk_create(batch)
+                if return_ids:
+                    ids.extend(obj.pk for obj in created)
+                total += len(created)
+                batch = []
+        created = model.objects.bulk_create(batch)
+        if return_ids:
+            ids.extend(obj.pk for obj in created)
+        total += len(created)
+        self.stdout.write(f"{model._meta.model_name}: {total}")
+        return ids
+
+    def create_categories(self, count, depth):
+        # Spread the categories over ``depth`` levels, each one parented to a
+        # random category of the level above
+        ids, parents, number = [], [None], 0
+        depth = max(depth, 1)
+        for level in range(depth):
+            size = count // depth + (1 if level < count % depth else 0)
+            level_categories = []
+            for _ in range(size):
+                level_categories.append(DrugCategory(
+                    name=f"{self.prefix} category {number}",
+                    description=f"Level {level} category",
+                    parent_category_id=self.rng.choice(parents)
+                ))
+                number += 1
+            level_ids = [
+                category.pk
+                for category in DrugCategory.objects.bulk_create(level_categories)
+            ]
+            ids.extend(level_ids)
+            parents = level_ids or parents
+        self.stdout.write(f"drugcategory: {len(ids)}")
+        return ids
+
+    def create_suppliers(self, count):
+        return self.insert(Supplier, return_ids=True, rows=(
+            Supplier(
+                name=f"{self.prefix} supplier {i}",
+                contact_person=f"Contact {i}",
+                telephone=f"+1555{i:07d}",
+                email=f"supplier{i}@example.com",
+                address=f"{i} Warehouse Road",
+                created_at=self.timestamp()
+            )
+            for i in range(count)
+        ))
+
+    def create_drugs(self, count, category_ids):
+        units = [unit for unit, _ in Drug.UNIT_TYPES]
+        return self.insert(Drug, return_ids=True, rows=(
+            Drug(
+                category_id=self.rng.choice(category_ids),
+                name=f"{self.prefix} drug {i}",
+                description=f"Synthetic drug number {i}",
+                SKU=f"{self.prefix}-{i:07d}",
+                dispense_unit=self.rng.choice(units)
+            )
+            for i in range(count)
+        ))
+
+    def create_inventory(self, drug_ids):
+        self.insert(Inventory, (
+            Inventory(
+                drug_id=drug_id,
+                quantity=self.rng.randrange(0, 1000),
+                reorder_level=self.rng.randrange(10, 100),
+                time_created=self.timestamp()
+            )
+            for drug_id in drug_ids
+        ))
+
+    def create_price_history(self, count, drug_ids):
+        self.insert(PriceHistory, (
+            PriceHistory(
+                drug_id=self.rng.choice(drug_ids),
+                purchase_price=self.price(1, 200),
+                time_created=self.timestamp()
+            )
+            for _ in range(count)
+        ))
+
+    def create_transactions(self, count, drug_ids):
+        def rows():
+            for _ in range(count):
+                is_sale = self.rng.random() < 0.8
+                yield Transaction(
+                    drug_id=self.rng.choice(drug_ids),
+                    transaction_type='SALE' if is_sale else 'USAGE',
+                    quantity=self.rng.randrange(1, 20),
+                    selling_price=self.price(2, 300) if is_sale else None,
+                    time_created=self.timestamp()
+                )
+        self.insert(Transaction, rows())
+
+    def create_orders(self, count, max_lines, supplier_ids, drug_ids):
+        statuses = [status for status, _ in Order.STATUS_CHOICES]
+
+        def order():
+            status, time_created = self.rng.choice(statuses), self.timestamp()
+            return Order(
+                supplier_id=self.rng.choice(supplier_ids),
+                status=status,
+                time_created=time_created,
+                received_at=time_created if status == 'RECEIVED' else None
+            )
+
+        order_ids = self.insert(Order, return_ids=True, rows=(
+            order() for _ in range(count)
+        ))
+        self.insert(OrderItem, (
+            OrderItem(
+                order_id=order_id,
+                drug_id=drug_id,
+                quantity=self.rng.randrange(10, 500),
+                purchase_price=self.price(1, 200)
+            )
+            for order_id in order_ids
+            for drug_id in self.rng.sample(
+                drug_ids, min(len(drug_ids), self.rng.randrange(1, max_lines + 1))
+            )
+        ))
+
+    def create_notifications(self, count, drug_ids):
+        types = [notification for notification, _ in Notifications.NOTIFICATION_TYPES]
+        self.insert(Notifications, (
+            Notifications(
+                drug_id=self.rng.choice(drug_ids),
+                notification_type=self.rng.choice(types),
+                message="Synthetic alert",
+                is_read=self.rng.random() < 0.7,
+                created_at=self.timestamp()
+            )
+            for _ in range(count)
+        ))
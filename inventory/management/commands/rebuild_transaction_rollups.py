@@ -0,0 +1,54 @@
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncDay, TruncHour
+from django.core.management.base import BaseCommand
+from inventory.models import Transaction, TransactionRollup
+
+class Command(BaseCommand):
+    help = "Recompute the hourly and daily transaction rollups from scratch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        truncs = {'HOUR': TruncHour, 'DAY': TruncDay}
+        revenue_field = DecimalField(max_digits=14, decimal_places=2)
+
+        with transaction.atomic():
+            TransactionRollup.objects.all().delete()
+            for granularity, trunc in truncs.items():
+                buckets = Transaction.objects.annotate(
+                    period_start=trunc('time_created')
+                ).values(
+                    'period_start', 'drug_id', 'transaction_type'
+                ).annotate(
+                    total_quantity=Sum('quantity'),
+                    total_revenue=Coalesce(
+                        Sum(F('quantity') * F('selling_price'),
+                            output_field=revenue_field),
+                        Value(Decimal('0')),
+                        output_field=revenue_field
+                    ),
+                    total_count=Count('id')
+                ).order_by()
+
+                rollups, created = [], 0
+                for bucket in buckets.iterator(chunk_size=batch_size):
+                    rollups.append(TransactionRollup(
+                        granularity=granularity,
+                        drug_id=bucket['drug_id'],
+                        transaction_type=bucket['transaction_type'],
+                        period_start=bucket['period_start'],
+                        quantity=bucket['total_quantity'],
+                        revenue=bucket['total_revenue'],
+                        count=bucket['total_count']
+                    ))
+                    if len(rollups) >= batch_size:
+                        created += len(TransactionRollup.objects.bulk_create(rollups))
+                        rollups = []
+                created += len(TransactionRollup.objects.bulk_create(rollups))
+                self.stdout.write(f"{granularity}: {created} bucket(s)")
+
+        self.stdout.write(self.style.SUCCESS("Transaction rollups rebuilt"))
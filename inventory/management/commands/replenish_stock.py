@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from inventory.models import Order
+
+class Command(BaseCommand):
+    help = (
+        "Draft one purchase order per supplier covering every drug at or "
+        "below its reorder level"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--order-up-to', type=int, default=2,
+            help="Order enough to reach this multiple of the reorder level"
+        )
+
+    def handle(self, *args, **options):
+        orders, never_ordered = Order.create_replenishment_orders(
+            order_up_to=options['order_up_to']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(orders)} draft order(s)"
+        ))
+        if never_ordered:
+            self.stdout.write(self.style.WARNING(
+                f"{len(never_ordered)} low-stock drug(s) have no order history "
+                f"to pick a supplier from: {', '.join(map(str, never_ordered))}"
+            ))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from inventory.models import Notifications
+
+class Command(BaseCommand):
+    help = (
+        "Raise EXPIRY notifications for every drug holding stock lots that "
+        "have expired or expire soon"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.EXPIRY_WARNING_DAYS,
+            help="Warn about lots expiring within this many days"
+        )
+
+    def handle(self, *args, **options):
+        alerts = Notifications.create_expiry_alerts(days=options['days'])
+        self.stdout.write(
+            self.style.SUCCESS(f"Created {len(alerts)} expiry alert(s)")
+        )
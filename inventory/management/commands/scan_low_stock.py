@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from inventory.models import Notifications
+
+class Command(BaseCommand):
+    help = "Raise LOW_STOCK notifications for every drug at or below its reorder level"
+
+    def handle(self, *args, **options):
+        alerts = Notifications.create_low_stock_alerts()
+        self.stdout.write(
+            self.style.SUCCESS(f"Created {len(alerts)} low stock alert(s)")
+        )
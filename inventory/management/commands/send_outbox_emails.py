@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand
+from inventory.models import EmailOutbox
+
+class Command(BaseCommand):
+    help = "Deliver queued notification emails in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help="Keep polling the outbox instead of exiting once it is drained"
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=10,
+            help="Seconds to sleep between polls when --loop is set"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            while True:
+                sent = EmailOutbox.deliver_pending(
+                    batch_size=options['batch_size'],
+                    max_attempts=options['max_attempts']
+                )
+                if not sent:
+                    break
+                total += sent
+            if total or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f"Sent {total} email(s)"))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from inventory.models import StockSnapshot
+
+class Command(BaseCommand):
+    help = (
+        "Record the stock on hand of every drug, the starting point for "
+        "point-in-time stock lookups; run periodically, e.g. nightly"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        taken_at, count = StockSnapshot.take(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshotted stock of {count} drug(s) at {taken_at.isoformat()}"
+        ))
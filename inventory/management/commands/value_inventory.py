@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from inventory.valuation import rebuild_valuations
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the FIFO and weighted-average valuation of every drug "
+        "from the full receipt and transaction ledger"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Drugs valued, and locked, per batch"
+        )
+
+    def handle(self, *args, **options):
+        count = rebuild_valuations(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Valued stock of {count} drug(s)"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from inventory.models import StockLot
+
+class Command(BaseCommand):
+    help = (
+        "Write off every expired stock lot, taking its units out of stock "
+        "and valuation; run daily after the expiry scan"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--drug', type=int, action='append', dest='drugs',
+            help="Only write off lots of this drug id; may be repeated"
+        )
+
+    def handle(self, *args, **options):
+        lots = StockLot.objects.all()
+        if options['drugs']:
+            lots = lots.filter(drug_id__in=options['drugs'])
+        transactions = StockLot.write_off_expired(lots)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote off {sum(item.quantity for item in transactions)} expired "
+            f"unit(s) of {len(transactions)} drug(s)"
+        ))
@@ -0,0 +1,208 @@
+"""
+In-process request metrics exposed in the Prometheus text format.
+
+MetricsMiddleware records, per route and method, the request latency, the
+number and duration of SQL queries, the time spent producing serializer
+data and the response size. Each worker process keeps its own histograms;
+Prometheus scrapes and sums them per instance.
+"""
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db.backends.utils import CursorWrapper
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.serializers import BaseSerializer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+class Histogram:
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # One counter per bucket, then the running sum and count
+                series = self.series[labels] = [0] * len(self.buckets) + [0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            snapshot = {labels: list(series) for labels, series in self.series.items()}
+        for (route, method), series in sorted(snapshot.items()):
+            labels = f'method="{method}",route="{route}"'
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{labels}}} {series[-1]}')
+        return "\n".join(lines)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    "Time spent handling the request.",
+    LATENCY_BUCKETS
+)
+QUERY_COUNT = Histogram(
+    'http_request_db_queries',
+    "SQL queries executed per request.",
+    QUERY_COUNT_BUCKETS
+)
+QUERY_TIME = Histogram(
+    'http_request_db_query_duration_seconds',
+    "Time spent in SQL queries per request.",
+    LATENCY_BUCKETS
+)
+SERIALIZER_TIME = Histogram(
+    'http_request_serializer_duration_seconds',
+    "Time spent building serializer data per request.",
+    LATENCY_BUCKETS
+)
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes',
+    "Size of the response body.",
+    SIZE_BUCKETS
+)
+HISTOGRAMS = [REQUEST_LATENCY, QUERY_COUNT, QUERY_TIME, SERIALIZER_TIME, RESPONSE_SIZE]
+
+class RequestStats:
+    __slots__ = ('queries', 'query_time', 'serializer_time', 'serializer_depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+current_stats = ContextVar('inventory_request_stats', default=None)
+
+@contextmanager
+def serializer_timer():
+    """Time the outermost serializer ``.data`` call of the current request."""
+    stats = current_stats.get()
+    if stats is None:
+        yield
+        return
+    stats.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_depth -= 1
+        if not stats.serializer_depth:
+            stats.serializer_time += time.perf_counter() - started
+
+def instrument_serializers():
+    """
+    Wrap BaseSerializer.data, the single entry point through which every
+    top-level serializer (single or many=True) produces its output.
+    """
+    if getattr(BaseSerializer.data.fget, 'instrumented', False):
+        return
+    original = BaseSerializer.data.fget
+
+    def data(self):
+        with serializer_timer():
+            return original(self)
+
+    data.instrumented = True
+    BaseSerializer.data = property(data)
+
+def instrument_queries():
+    """
+    Wrap CursorWrapper.execute and executemany, through which every query of
+    every connection runs, whichever thread holds it. Under ASGI the ORM
+    runs on sync_to_async worker threads with their own connections; the
+    request's stats reach them through the current_stats context variable,
+    which those threads inherit.
+    """
+    if getattr(CursorWrapper.execute, 'instrumented', False):
+        return
+
+    def instrument(original):
+        def method(self, *args, **kwargs):
+            stats = current_stats.get()
+            if stats is None:
+                return original(self, *args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return original(self, *args, **kwargs)
+            finally:
+                stats.queries += 1
+                stats.query_time += time.perf_counter() - started
+
+        method.instrumented = True
+        return method
+
+    CursorWrapper.execute = instrument(CursorWrapper.execute)
+    CursorWrapper.executemany = instrument(CursorWrapper.executemany)
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Stay async under ASGI so async views are not pushed onto threads
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        instrument_serializers()
+        instrument_queries()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with self.tracking() as stats:
+            response = self.get_response(request)
+        return self.record(request, response, stats, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with self.tracking() as stats:
+            response = await self.get_response(request)
+        return self.record(request, response, stats, time.perf_counter() - started)
+
+    @contextmanager
+    def tracking(self):
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            yield stats
+        finally:
+            current_stats.reset(token)
+
+    def record(self, request, response, stats, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        labels = (match.view_name if match else 'unmatched', request.method)
+        REQUEST_LATENCY.observe(labels, elapsed)
+        QUERY_COUNT.observe(labels, stats.queries)
+        QUERY_TIME.observe(labels, stats.query_time)
+        SERIALIZER_TIME.observe(labels, stats.serializer_time)
+        if not response.streaming:
+            RESPONSE_SIZE.observe(labels, len(response.content))
+        return response
+
+class MetricsView(View):
+    def get(self, request):
+        body = "\n".join(histogram.render() for histogram in HISTOGRAMS) + "\n"
+        return HttpResponse(body, content_type='text/plain; version=0.0.4')
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="inventory",
+            index=models.Index(
+                condition=models.Q(("quantity__lte", models.F("reorder_level"))),
+                fields=["drug"],
+                name="inventory_low_stock_idx",
+            ),
+        ),
+    ]
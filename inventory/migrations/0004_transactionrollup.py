@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:35
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0003_emailoutbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TransactionRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "transaction_type",
+                    models.CharField(
+                        choices=[("SALE", "Sale"), ("USAGE", "Usage")], max_length=10
+                    ),
+                ),
+                (
+                    "granularity",
+                    models.CharField(
+                        choices=[("HOUR", "Hourly"), ("DAY", "Daily")], max_length=4
+                    ),
+                ),
+                ("period_start", models.DateTimeField()),
+                ("quantity", models.BigIntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(
+                        decimal_places=2,
+                        default=Decimal("0"),
+                        help_text="Sum of quantity * selling_price",
+                        max_digits=14,
+                    ),
+                ),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "drug",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rollups",
+                        to="inventory.drug",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["granularity", "period_start"], name="rollup_period_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=(
+                            "granularity",
+                            "drug",
+                            "transaction_type",
+                            "period_start",
+                        ),
+                        name="unique_transaction_rollup_bucket",
+                    )
+                ],
+            },
+        ),
+    ]
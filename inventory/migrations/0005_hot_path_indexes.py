@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0004_transactionrollup"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notifications",
+            index=models.Index(
+                condition=models.Q(("is_read", False)),
+                fields=["drug", "notification_type"],
+                name="notifications_unread_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notifications",
+            index=models.Index(
+                fields=["created_at", "id"], name="notifications_created_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["status", "time_created"], name="order_status_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pricehistory",
+            index=models.Index(
+                fields=["drug", "-time_created"], name="pricehistory_drug_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pricehistory",
+            index=models.Index(
+                fields=["time_created", "id"], name="pricehistory_time_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["drug", "time_created"], name="transaction_drug_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["time_created", "id"], name="transaction_time_id_idx"
+            ),
+        ),
+    ]
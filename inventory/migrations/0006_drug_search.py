@@ -0,0 +1,84 @@
+from django.db import migrations
+
+POSTGRES_FORWARDS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    ALTER TABLE inventory_drug ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce("SKU", '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX drug_search_vector_idx ON inventory_drug USING gin (search_vector)",
+    "CREATE INDEX drug_name_trgm_idx ON inventory_drug USING gin (name gin_trgm_ops)",
+    'CREATE INDEX drug_sku_trgm_idx ON inventory_drug USING gin ("SKU" gin_trgm_ops)',
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS drug_sku_trgm_idx",
+    "DROP INDEX IF EXISTS drug_name_trgm_idx",
+    "DROP INDEX IF EXISTS drug_search_vector_idx",
+    "ALTER TABLE inventory_drug DROP COLUMN IF EXISTS search_vector",
+]
+
+# External-content FTS5 table kept in sync by triggers. SQLite rebuilds the
+# table on most ALTERs, which drops the triggers: a later migration that
+# alters inventory_drug must recreate them.
+SQLITE_FORWARDS = [
+    """
+    CREATE VIRTUAL TABLE inventory_drug_fts USING fts5(
+        name, SKU, description, content='inventory_drug', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER inventory_drug_fts_insert AFTER INSERT ON inventory_drug BEGIN
+        INSERT INTO inventory_drug_fts(rowid, name, SKU, description)
+        VALUES (new.id, new.name, new.SKU, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER inventory_drug_fts_delete AFTER DELETE ON inventory_drug BEGIN
+        INSERT INTO inventory_drug_fts(inventory_drug_fts, rowid, name, SKU, description)
+        VALUES ('delete', old.id, old.name, old.SKU, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER inventory_drug_fts_update AFTER UPDATE ON inventory_drug BEGIN
+        INSERT INTO inventory_drug_fts(inventory_drug_fts, rowid, name, SKU, description)
+        VALUES ('delete', old.id, old.name, old.SKU, old.description);
+        INSERT INTO inventory_drug_fts(rowid, name, SKU, description)
+        VALUES (new.id, new.name, new.SKU, new.description);
+    END
+    """,
+    "INSERT INTO inventory_drug_fts(inventory_drug_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS inventory_drug_fts_update",
+    "DROP TRIGGER IF EXISTS inventory_drug_fts_delete",
+    "DROP TRIGGER IF EXISTS inventory_drug_fts_insert",
+    "DROP TABLE IF EXISTS inventory_drug_fts",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0005_hot_path_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({"postgresql": POSTGRES_FORWARDS, "sqlite": SQLITE_FORWARDS}),
+            run({"postgresql": POSTGRES_BACKWARDS, "sqlite": SQLITE_BACKWARDS}),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_received_at(apps, schema_editor):
+    # The receipt time of older orders was never stored; their creation
+    # time is the closest value on record
+    Order = apps.get_model("inventory", "Order")
+    Order.objects.filter(status="RECEIVED", received_at__isnull=True).update(
+        received_at=F("time_created")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0006_drug_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StockSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.PositiveIntegerField()),
+                ("taken_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="received_at",
+            field=models.DateTimeField(
+                blank=True, help_text="When the order was booked into stock", null=True
+            ),
+        ),
+        migrations.RunPython(backfill_received_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["received_at"], name="order_received_idx"),
+        ),
+        migrations.AddField(
+            model_name="stocksnapshot",
+            name="drug",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="snapshots",
+                to="inventory.drug",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stocksnapshot",
+            index=models.Index(
+                fields=["taken_at", "drug"], name="stocksnapshot_taken_idx"
+            ),
+        ),
+    ]
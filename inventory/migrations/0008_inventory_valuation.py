@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:55
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0007_stock_snapshots"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InventoryValuation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "quantity",
+                    models.PositiveBigIntegerField(
+                        default=0,
+                        help_text="Units on hand covered by received cost layers",
+                    ),
+                ),
+                (
+                    "fifo_layers",
+                    models.JSONField(
+                        default=list,
+                        help_text="Remaining [quantity, unit cost] layers, oldest first",
+                    ),
+                ),
+                (
+                    "fifo_value",
+                    models.DecimalField(
+                        decimal_places=2, default=Decimal("0"), max_digits=14
+                    ),
+                ),
+                (
+                    "average_cost",
+                    models.DecimalField(
+                        decimal_places=4, default=Decimal("0"), max_digits=12
+                    ),
+                ),
+                (
+                    "average_value",
+                    models.DecimalField(
+                        decimal_places=2, default=Decimal("0"), max_digits=14
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "drug",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="valuation",
+                        to="inventory.drug",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0008_inventory_valuation"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="order",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("DRAFT", "Draft"),
+                    ("PLACED", "Placed"),
+                    ("IN_PROGRESS", "In Progress"),
+                    ("RECEIVED", "Received"),
+                ],
+                default="PLACED",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0009_order_draft_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="orderitem",
+            name="expiry_date",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="lot_number",
+            field=models.CharField(blank=True, default="", max_length=50),
+        ),
+        migrations.CreateModel(
+            name="StockLot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("lot_number", models.CharField(blank=True, default="", max_length=50)),
+                (
+                    "expiry_date",
+                    models.DateField(
+                        blank=True,
+                        help_text="Empty for stock that does not expire",
+                        null=True,
+                    ),
+                ),
+                (
+                    "quantity",
+                    models.PositiveIntegerField(help_text="Units left in this lot"),
+                ),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "drug",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lots",
+                        to="inventory.drug",
+                    ),
+                ),
+                (
+                    "order_item",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="lots",
+                        to="inventory.orderitem",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("quantity__gt", 0)),
+                        fields=["expiry_date", "drug"],
+                        name="stocklot_expiry_idx",
+                    ),
+                    models.Index(
+                        condition=models.Q(("quantity__gt", 0)),
+                        fields=["drug", "expiry_date"],
+                        name="stocklot_drug_expiry_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0010_stock_lots"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="transaction",
+            name="transaction_type",
+            field=models.CharField(
+                choices=[
+                    ("SALE", "Sale"),
+                    ("USAGE", "Usage"),
+                    ("WRITE_OFF", "Write-off"),
+                ],
+                max_length=10,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="transactionrollup",
+            name="transaction_type",
+            field=models.CharField(
+                choices=[
+                    ("SALE", "Sale"),
+                    ("USAGE", "Usage"),
+                    ("WRITE_OFF", "Write-off"),
+                ],
+                max_length=10,
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0011_write_off_transactions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="lot",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="The expired lot a write-off emptied",
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="write_offs",
+                to="inventory.stocklot",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="inventoryvaluation",
+            name="fifo_layers",
+            field=models.JSONField(
+                default=list,
+                help_text="Remaining [quantity, unit cost, order line id] layers, oldest first",
+            ),
+        ),
+    ]
@@ -1,10 +1,34 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (
+    Case, Exists, F, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
+from datetime import timedelta
 from decimal import Decimal
+from collections import defaultdict
 from django.core.exceptions import ValidationError
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
-from django.utils.timezone import now
+from django.utils.timezone import localtime, now
+from .cache import bump_model_version, update_and_bump
+
+class InsufficientStockError(Exception):
+    """Raised when a stock decrement would take an inventory row below zero."""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(
+            "Insufficient stock for drug(s): "
+            + ", ".join(str(drug_id) for drug_id in shortages)
+        )
+
+class OrderAlreadyReceivedError(Exception):
+    """Raised when stock for an order that was already received is booked again."""
+
+    def __init__(self, order_id):
+        self.order_id = order_id
+        super().__init__(f"Order {order_id} has already been received")
 
 class DrugCategory(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -69,6 +93,16 @@ class PriceHistory(models.Model):
     class Meta:
         ordering = ['-time_created']
         verbose_name_plural = "Price Histories"
+        indexes = [
+            models.Index(
+                fields=['drug', '-time_created'],
+                name='pricehistory_drug_time_idx'
+            ),
+            models.Index(
+                fields=['time_created', 'id'],
+                name='pricehistory_time_id_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Price history for {self.drug.name} - {self.time_created.date()}"
@@ -88,6 +122,7 @@ class Supplier(models.Model):
 
 class Order(models.Model):
     STATUS_CHOICES = [
+        ('DRAFT', 'Draft'),
         ('PLACED', 'Placed'),
         ('IN_PROGRESS', 'In Progress'),
         ('RECEIVED', 'Received')
@@ -106,10 +141,133 @@ class Order(models.Model):
         default='PLACED'
     )
     time_created = models.DateTimeField(auto_now_add=True)
+    received_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the order was booked into stock"
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['status', 'time_created'],
+                name='order_status_time_idx'
+            ),
+            models.Index(fields=['received_at'], name='order_received_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.id} - {self.supplier.name}"
 
+    def receive(self):
+        """
+        Book the order into stock: add every line's quantity to Inventory
+        with one set-based UPDATE, add the lines as cost layers to the
+        valuation and as stock lots, append one PriceHistory row per drug in
+        a single batch and mark the order RECEIVED, all atomically. The order row is locked
+        first, so a second receipt waits and then fails with
+        OrderAlreadyReceivedError instead of adding the stock twice.
+        """
+        with transaction.atomic():
+            order = Order.objects.select_for_update().get(pk=self.pk)
+            if order.status == 'RECEIVED':
+                raise OrderAlreadyReceivedError(self.pk)
+
+            quantities, prices, layers = defaultdict(int), {}, defaultdict(list)
+            items = list(order.items.order_by('drug_id', 'id'))
+            for item in items:
+                quantities[item.drug_id] += item.quantity
+                prices[item.drug_id] = item.purchase_price
+                layers[item.drug_id].append((item.quantity, item.purchase_price, item.id))
+
+            Inventory.increment_stock(quantities)
+            InventoryValuation.receive(layers)
+            StockLot.objects.bulk_create([
+                StockLot(
+                    drug_id=item.drug_id,
+                    order_item=item,
+                    lot_number=item.lot_number,
+                    expiry_date=item.expiry_date,
+                    quantity=item.quantity
+                )
+                for item in items if item.quantity
+            ])
+            PriceHistory.objects.bulk_create([
+                PriceHistory(drug_id=drug_id, purchase_price=price)
+                for drug_id, price in prices.items()
+            ])
+            bump_model_version(PriceHistory)
+
+            order.status = 'RECEIVED'
+            order.received_at = now()
+            order.save(update_fields=['status', 'received_at'])
+        self.status = 'RECEIVED'
+        self.received_at = order.received_at
+
+    @classmethod
+    def create_replenishment_orders(cls, order_up_to=2):
+        """
+        Draft purchase orders for every drug at or below its reorder level,
+        one order per supplier. A drug is ordered from the supplier of its
+        most recent order, at the last price paid, for enough units to bring
+        stock plus units already on open orders up to ``order_up_to`` times
+        its reorder level. Suppliers, prices and open quantities all come
+        from one query over the low-stock rows; the orders and their lines
+        are written with one batched insert each.
+        Returns the created orders and the ids of low-stock drugs that have
+        never been ordered.
+        """
+        history = OrderItem.objects.filter(
+            drug=OuterRef('drug')
+        ).exclude(order__status='DRAFT').order_by('-order__time_created', '-id')
+        on_order = OrderItem.objects.filter(
+            drug=OuterRef('drug'), order__status__in=['DRAFT', 'PLACED', 'IN_PROGRESS']
+        ).values('drug').annotate(total=Sum('quantity')).values('total')
+
+        with transaction.atomic():
+            # Concurrent runs queue on the low-stock rows, locked in drug id
+            # order like every other stock writer, so each one reads the
+            # open quantities only after the previous run's drafts commit
+            list(
+                Inventory.objects.select_for_update()
+                .filter(quantity__lte=F('reorder_level'))
+                .order_by('drug_id')
+                .values_list('id', flat=True)
+            )
+            shortfalls = Inventory.objects.filter(
+                quantity__lte=F('reorder_level')
+            ).annotate(
+                supplier_id=Subquery(history.values('order__supplier')[:1]),
+                last_price=Subquery(history.values('purchase_price')[:1]),
+                on_order=Coalesce(Subquery(on_order), 0)
+            ).values_list(
+                'drug_id', 'quantity', 'reorder_level', 'supplier_id', 'last_price',
+                'on_order'
+            )
+
+            lines, never_ordered = defaultdict(list), []
+            for drug_id, quantity, reorder_level, supplier_id, price, pending in shortfalls:
+                units = reorder_level * order_up_to - quantity - pending
+                if units <= 0:
+                    continue
+                if supplier_id is None:
+                    never_ordered.append(drug_id)
+                    continue
+                lines[supplier_id].append(
+                    OrderItem(drug_id=drug_id, quantity=units, purchase_price=price)
+                )
+
+            orders = cls.objects.bulk_create([
+                cls(supplier_id=supplier_id, status='DRAFT') for supplier_id in lines
+            ])
+            items = []
+            for order, supplier_lines in zip(orders, lines.values()):
+                for item in supplier_lines:
+                    item.order = order
+                    items.append(item)
+            OrderItem.objects.bulk_create(items)
+        return orders, never_ordered
+
 class OrderItem(models.Model):
     # Foreign Keys as per ERD
     order = models.ForeignKey(
@@ -129,6 +287,8 @@ class OrderItem(models.Model):
         decimal_places=2,
         help_text="Unit cost at time of order"
     )
+    lot_number = models.CharField(max_length=50, blank=True, default='')
+    expiry_date = models.DateField(null=True, blank=True)
 
     def __str__(self):
         return f"Order {self.order.id} - {self.drug.name} ({self.quantity})"
@@ -136,7 +296,8 @@ class OrderItem(models.Model):
 class Transaction(models.Model):
     TRANSACTION_TYPES = [
         ('SALE', 'Sale'),
-        ('USAGE', 'Usage')
+        ('USAGE', 'Usage'),
+        ('WRITE_OFF', 'Write-off')
     ]
     
     # Foreign Key as per ERD
@@ -158,11 +319,157 @@ class Transaction(models.Model):
         blank=True,
         help_text="Only applicable for sales"
     )
+    lot = models.ForeignKey(
+        'StockLot',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='write_offs',
+        help_text="The expired lot a write-off emptied"
+    )
     time_created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['drug', 'time_created'],
+                name='transaction_drug_time_idx'
+            ),
+            models.Index(
+                fields=['time_created', 'id'],
+                name='transaction_time_id_idx'
+            ),
+        ]
+
     def __str__(self):
         return f"{self.transaction_type} - {self.drug.name} ({self.quantity})"
 
+    @classmethod
+    def create_batch(cls, transactions):
+        """
+        Insert ``transactions`` with one batched INSERT. bulk_create() skips
+        post_save, so the batch is added to the rollups here instead.
+        """
+        transactions = cls.objects.bulk_create(transactions)
+        TransactionRollup.record(transactions)
+        return transactions
+
+class TransactionRollup(models.Model):
+    """
+    Hourly and daily totals of Transaction rows per drug and transaction
+    type. Kept up to date incrementally as transactions are written so time
+    series reads touch one row per bucket instead of every transaction.
+    """
+    GRANULARITIES = [
+        ('HOUR', 'Hourly'),
+        ('DAY', 'Daily'),
+    ]
+
+    drug = models.ForeignKey(
+        Drug,
+        on_delete=models.CASCADE,
+        related_name='rollups'
+    )
+    transaction_type = models.CharField(
+        max_length=10,
+        choices=Transaction.TRANSACTION_TYPES
+    )
+    granularity = models.CharField(max_length=4, choices=GRANULARITIES)
+    period_start = models.DateTimeField()
+    quantity = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=Decimal('0'),
+        help_text="Sum of quantity * selling_price"
+    )
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'drug', 'transaction_type', 'period_start'],
+                name='unique_transaction_rollup_bucket'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['granularity', 'period_start'],
+                name='rollup_period_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.granularity} {self.transaction_type} - "
+            f"{self.drug_id} @ {self.period_start}"
+        )
+
+    @staticmethod
+    def period_start_for(timestamp, granularity):
+        timestamp = localtime(timestamp).replace(minute=0, second=0, microsecond=0)
+        if granularity == 'DAY':
+            timestamp = timestamp.replace(hour=0)
+        return timestamp
+
+    @classmethod
+    def record(cls, transactions, sign=1):
+        """
+        Add ``transactions`` to their hourly and daily buckets (or remove
+        them with ``sign=-1``). Missing buckets are inserted in one batch and
+        all increments are applied with a single UPDATE, so concurrent
+        writers never overwrite each other's totals.
+        """
+        totals = defaultdict(lambda: [0, Decimal('0'), 0])
+        for item in transactions:
+            revenue = item.quantity * Decimal(item.selling_price or 0)
+            for granularity, _ in cls.GRANULARITIES:
+                bucket = totals[(
+                    granularity,
+                    item.drug_id,
+                    item.transaction_type,
+                    cls.period_start_for(item.time_created, granularity),
+                )]
+                bucket[0] += sign * item.quantity
+                bucket[1] += sign * revenue
+                bucket[2] += sign
+        if not totals:
+            return
+
+        with transaction.atomic():
+            cls.objects.bulk_create(
+                [
+                    cls(granularity=granularity, drug_id=drug_id,
+                        transaction_type=transaction_type, period_start=period)
+                    for granularity, drug_id, transaction_type, period in totals
+                ],
+                ignore_conflicts=True
+            )
+            rows = cls.objects.filter(
+                drug_id__in={key[1] for key in totals},
+                transaction_type__in={key[2] for key in totals},
+                period_start__in={key[3] for key in totals}
+            ).values_list(
+                'id', 'granularity', 'drug_id', 'transaction_type', 'period_start'
+            )
+            ids = {tuple(row[1:]): row[0] for row in rows}
+            increments = {ids[key]: value for key, value in totals.items()}
+
+            def by_id(position, output_field):
+                return Case(
+                    *[When(id=row_id, then=Value(value[position]))
+                      for row_id, value in increments.items()],
+                    output_field=output_field
+                )
+
+            cls.objects.filter(id__in=increments).update(
+                quantity=F('quantity') + by_id(0, models.BigIntegerField()),
+                revenue=F('revenue') + by_id(
+                    1, models.DecimalField(max_digits=14, decimal_places=2)
+                ),
+                count=F('count') + by_id(2, models.IntegerField())
+            )
+
 class Notifications(models.Model):
     NOTIFICATION_TYPES = [
         ('LOW_STOCK', 'Low Stock Alert'),
@@ -174,7 +481,25 @@ class Notifications(models.Model):
     message = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Unread alerts are what the dedupe checks and inbox filter on
+            models.Index(
+                fields=['drug', 'notification_type'],
+                condition=Q(is_read=False),
+                name='notifications_unread_idx'
+            ),
+            models.Index(
+                fields=['created_at', 'id'],
+                name='notifications_created_id_idx'
+            ),
+        ]
     
+    @staticmethod
+    def low_stock_message(drug, quantity):
+        return f"Low stock alert for {drug.name}. Current stock: {quantity}"
+
     @classmethod
     def create_low_stock_alert(cls, drug):
         if not cls.objects.filter(
@@ -182,20 +507,203 @@ class Notifications(models.Model):
             notification_type='LOW_STOCK',
             is_read=False
         ).exists():
-            message = f"Low stock alert for {drug.name}. Current stock: {drug.current_stock}"
-            cls.objects.create(
-                drug=drug,
-                notification_type='LOW_STOCK',
-                message=message
+            message = cls.low_stock_message(drug, drug.inventory.quantity)
+            with transaction.atomic():
+                notification = cls.objects.create(
+                    drug=drug,
+                    notification_type='LOW_STOCK',
+                    message=message
+                )
+                # Queue the email; send_outbox_emails delivers it
+                EmailOutbox.enqueue([notification])
+
+    @classmethod
+    def create_low_stock_alerts(cls, inventories=None):
+        """
+        Scan ``inventories`` (all Inventory rows by default) for stock at or
+        below its reorder level and raise one LOW_STOCK alert per drug that
+        has no unread one yet. The breaching rows are found with a single
+        column-to-column query that already excludes drugs with unread
+        alerts, and the new alerts are written with one batched insert.
+        Returns the created notifications.
+        """
+        if inventories is None:
+            inventories = Inventory.objects.all()
+        unread_alert = cls.objects.filter(
+            drug=OuterRef('drug'),
+            notification_type='LOW_STOCK',
+            is_read=False
+        )
+        breaching = inventories.filter(
+            quantity__lte=F('reorder_level')
+        ).exclude(Exists(unread_alert)).select_related('drug')
+
+        with transaction.atomic():
+            alerts = cls.objects.bulk_create([
+                cls(
+                    drug=inventory.drug,
+                    notification_type='LOW_STOCK',
+                    message=cls.low_stock_message(
+                        inventory.drug, inventory.quantity
+                    )
+                )
+                for inventory in breaching
+            ])
+            EmailOutbox.enqueue(alerts)
+        return alerts
+
+    @staticmethod
+    def expiry_message(drug, expiry_date, quantity):
+        if expiry_date < localtime(now()).date():
+            return f"Expired stock of {drug.name}: {quantity} unit(s) expired on {expiry_date}"
+        return f"Expiry alert for {drug.name}: {quantity} unit(s) expire by {expiry_date}"
+
+    @classmethod
+    def create_expiry_alerts(cls, days=None):
+        """
+        Raise one EXPIRY alert per drug holding stock lots that have expired
+        or expire within ``days`` (EXPIRY_WARNING_DAYS by default), unless the
+        drug already has an unread one. The lots are found and summed per
+        drug in a single query on the expiry index, and the alerts are
+        written with one batched insert. Returns the created notifications.
+        """
+        if days is None:
+            days = settings.EXPIRY_WARNING_DAYS
+        cutoff = localtime(now()).date() + timedelta(days=days)
+        unread_alert = cls.objects.filter(
+            drug=OuterRef('drug'),
+            notification_type='EXPIRY',
+            is_read=False
+        )
+        expiring = StockLot.objects.in_stock().filter(
+            expiry_date__lte=cutoff
+        ).exclude(Exists(unread_alert)).values('drug').annotate(
+            first_expiry=Min('expiry_date'), units=Sum('quantity')
+        ).order_by()
+        expiring = list(expiring)
+        drugs = Drug.objects.in_bulk([row['drug'] for row in expiring])
+
+        with transaction.atomic():
+            alerts = cls.objects.bulk_create([
+                cls(
+                    drug=drugs[row['drug']],
+                    notification_type='EXPIRY',
+                    message=cls.expiry_message(
+                        drugs[row['drug']], row['first_expiry'], row['units']
+                    )
+                )
+                for row in expiring
+            ])
+            EmailOutbox.enqueue(alerts)
+        return alerts
+
+class EmailOutbox(models.Model):
+    """
+    Emails waiting to be delivered. Rows are written in the same transaction
+    as the notification they announce and drained by the send_outbox_emails
+    command, so no request ever waits on SMTP.
+    """
+    notification = models.ForeignKey(
+        Notifications,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='emails'
+    )
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name_plural = "Email Outbox"
+        indexes = [
+            models.Index(
+                fields=['created_at', 'id'],
+                condition=Q(sent_at__isnull=True),
+                name='emailoutbox_pending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.recipient}"
+
+    @classmethod
+    def enqueue(cls, notifications, recipient=None):
+        recipient = recipient or settings.ADMIN_EMAIL
+        return cls.objects.bulk_create([
+            cls(
+                notification=notification,
+                recipient=recipient,
+                subject=(
+                    f'{notification.get_notification_type_display()}'
+                    f' - {notification.drug.name}'
+                ),
+                body=notification.message
             )
-            # Send email notification
-            send_mail(
-                subject=f'Low Stock Alert - {drug.name}',
-                message=message,
-                from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[settings.ADMIN_EMAIL],
-                fail_silently=True,
+            for notification in notifications
+        ])
+
+    @classmethod
+    def deliver_pending(cls, batch_size=100, max_attempts=5):
+        """
+        Claim up to ``batch_size`` pending emails with
+        SELECT ... FOR UPDATE SKIP LOCKED, coalesce them into one digest per
+        recipient and send them all over a single SMTP connection.
+        Returns the number of emails delivered.
+        """
+        with transaction.atomic():
+            batch = list(
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(sent_at__isnull=True, attempts__lt=max_attempts)
+                .order_by('created_at', 'id')[:batch_size]
             )
+            if not batch:
+                return 0
+
+            digests = {}
+            for email in batch:
+                digests.setdefault(email.recipient, []).append(email)
+
+            sent, failed = [], {}
+            connection = get_connection()
+            try:
+                connection.open()
+                for recipient, emails in digests.items():
+                    if len(emails) == 1:
+                        subject, body = emails[0].subject, emails[0].body
+                    else:
+                        subject = f'{len(emails)} inventory alerts'
+                        body = "\n\n".join(
+                            f"{email.subject}\n{email.body}" for email in emails
+                        )
+                    try:
+                        EmailMessage(
+                            subject=subject,
+                            body=body,
+                            from_email=settings.EMAIL_HOST_USER,
+                            to=[recipient],
+                            connection=connection,
+                        ).send()
+                        sent.extend(emails)
+                    except Exception as exc:
+                        failed[str(exc)] = failed.get(str(exc), []) + emails
+            except Exception as exc:
+                failed[str(exc)] = [email for email in batch if email not in sent]
+            finally:
+                connection.close()
+
+            cls.objects.filter(id__in=[email.id for email in sent]).update(
+                sent_at=now(), attempts=F('attempts') + 1
+            )
+            for error, emails in failed.items():
+                cls.objects.filter(id__in=[email.id for email in emails]).update(
+                    attempts=F('attempts') + 1, last_error=error
+                )
+            return len(sent)
 
 class Inventory(models.Model):
     # Foreign Key - One-to-One relationship with Drug
@@ -217,6 +725,431 @@ class Inventory(models.Model):
 
     class Meta:
         verbose_name_plural = "Inventories"
+        indexes = [
+            # Partial index holding only the rows at or below reorder level
+            models.Index(
+                fields=['drug'],
+                condition=Q(quantity__lte=F('reorder_level')),
+                name='inventory_low_stock_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Inventory for {self.drug.name}"
+
+    @staticmethod
+    def per_drug(values):
+        """``values``, a mapping of drug id -> count, as one SQL CASE on drug_id."""
+        return Case(
+            *[When(drug_id=drug_id, then=Value(value))
+              for drug_id, value in values.items()],
+            output_field=models.PositiveIntegerField()
+        )
+
+    @classmethod
+    def decrement_stock(cls, quantities):
+        """
+        Subtract ``quantities`` (a mapping of drug id -> units) from stock
+        in a single UPDATE. Rows are only touched when they hold enough
+        stock; if any drug falls short nothing is applied and
+        InsufficientStockError is raised.
+        """
+        if not quantities:
+            return
+        amount = cls.per_drug(quantities)
+        with transaction.atomic():
+            if len(quantities) > 1:
+                cls.lock_stock(quantities)
+            updated = update_and_bump(
+                cls.objects.filter(drug_id__in=quantities, quantity__gte=amount),
+                quantity=F('quantity') - amount, last_updated=now()
+            )
+            if updated == len(quantities):
+                InventoryValuation.consume(quantities)
+                StockLot.consume(quantities)
+                return
+            # Undo the rows that did have enough stock before reporting
+            transaction.set_rollback(True)
+
+        available = dict(
+            cls.objects.filter(drug_id__in=quantities)
+            .values_list('drug_id', 'quantity')
+        )
+        raise InsufficientStockError({
+            drug_id: {
+                'requested': units,
+                'available': available.get(drug_id, 0),
+            }
+            for drug_id, units in quantities.items()
+            if available.get(drug_id, 0) < units
+        })
+
+    @classmethod
+    def lock_stock(cls, drug_ids):
+        """
+        Row-lock the inventory of ``drug_ids`` in drug id order. Every writer
+        that touches several rows locks them in the same order, so concurrent
+        sales and receipts queue behind each other instead of deadlocking.
+        """
+        list(
+            cls.objects.select_for_update()
+            .filter(drug_id__in=drug_ids)
+            .order_by('drug_id')
+            .values_list('id', flat=True)
+        )
+
+    @classmethod
+    def increment_stock(cls, quantities):
+        """
+        Add ``quantities`` (a mapping of drug id -> units) to stock with a
+        single UPDATE, creating empty inventory rows for drugs that have none.
+        """
+        if not quantities:
+            return
+        with transaction.atomic():
+            cls.lock_stock(quantities)
+            cls.objects.bulk_create(
+                [cls(drug_id=drug_id, quantity=0, reorder_level=0)
+                 for drug_id in quantities],
+                ignore_conflicts=True
+            )
+            update_and_bump(
+                cls.objects.filter(drug_id__in=quantities),
+                quantity=F('quantity') + cls.per_drug(quantities), last_updated=now()
+            )
+
+class StockSnapshot(models.Model):
+    """
+    Stock on hand per drug at ``taken_at``, written for the whole catalog
+    at once by the take_stock_snapshots command. Stock at an earlier moment
+    is the nearest snapshot before it plus the sales, usage and receipts
+    recorded since, so a historical lookup replays at most one snapshot
+    interval of movements.
+    """
+    drug = models.ForeignKey(
+        Drug,
+        on_delete=models.CASCADE,
+        related_name='snapshots'
+    )
+    quantity = models.PositiveIntegerField()
+    taken_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['taken_at', 'drug'], name='stocksnapshot_taken_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.drug_id}: {self.quantity} @ {self.taken_at}"
+
+    @classmethod
+    def take(cls, batch_size=2000):
+        """
+        Snapshot every inventory row. The rows are locked in drug id order,
+        like every other stock writer, so no sale or receipt can land
+        between reading the quantities and stamping them.
+        """
+        with transaction.atomic():
+            quantities = list(
+                Inventory.objects.select_for_update()
+                .order_by('drug_id')
+                .values_list('drug_id', 'quantity')
+            )
+            taken_at = now()
+            cls.objects.bulk_create(
+                [cls(drug_id=drug_id, quantity=quantity, taken_at=taken_at)
+                 for drug_id, quantity in quantities],
+                batch_size=batch_size
+            )
+        return taken_at, len(quantities)
+
+    @classmethod
+    def stock_as_of(cls, moment, drug_ids=None):
+        """
+        Reconstruct stock at ``moment``. Returns the time of the snapshot
+        replayed from (None when there is none and the whole ledger is
+        replayed) and a mapping of drug id -> quantity.
+        """
+        snapshots = cls.objects.filter(taken_at__lte=moment)
+        transactions = Transaction.objects.filter(time_created__lte=moment)
+        receipts = OrderItem.objects.filter(
+            order__status='RECEIVED', order__received_at__lte=moment
+        )
+        if drug_ids is not None:
+            snapshots = snapshots.filter(drug_id__in=drug_ids)
+            transactions = transactions.filter(drug_id__in=drug_ids)
+            receipts = receipts.filter(drug_id__in=drug_ids)
+
+        quantities = defaultdict(int)
+        taken_at = snapshots.aggregate(taken_at=Max('taken_at'))['taken_at']
+        if taken_at is not None:
+            quantities.update(
+                snapshots.filter(taken_at=taken_at).values_list('drug_id', 'quantity')
+            )
+            transactions = transactions.filter(time_created__gt=taken_at)
+            receipts = receipts.filter(order__received_at__gt=taken_at)
+
+        for drug_id, quantity in (
+            transactions.values('drug_id').annotate(total=Sum('quantity'))
+            .values_list('drug_id', 'total').order_by()
+        ):
+            quantities[drug_id] -= quantity
+        for drug_id, quantity in (
+            receipts.values('drug_id').annotate(total=Sum('quantity'))
+            .values_list('drug_id', 'total').order_by()
+        ):
+            quantities[drug_id] += quantity
+        return taken_at, dict(quantities)
+
+class InventoryValuation(models.Model):
+    """
+    Stock of a drug valued at cost under FIFO and weighted-average cost.
+    Received order lines are the cost layers and transactions consume them.
+    Every receipt and every sale or usage updates the row of its drug in the
+    same database transaction, while the inventory row lock is held, so the
+    figures move in commit order. The value_inventory command rebuilds all
+    rows from the full ledger. Units that entered stock without a receipt
+    carry no cost and are not counted here.
+
+    Sales and usage take the oldest layers first. A write-off takes an
+    expired lot's units out of the layer of the order line that lot came
+    from, and only what that layer no longer holds from the oldest layers.
+    """
+    drug = models.OneToOneField(
+        Drug,
+        on_delete=models.CASCADE,
+        related_name='valuation'
+    )
+    quantity = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Units on hand covered by received cost layers"
+    )
+    fifo_layers = models.JSONField(
+        default=list,
+        help_text="Remaining [quantity, unit cost, order line id] layers, oldest first"
+    )
+    fifo_value = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
+    average_cost = models.DecimalField(max_digits=12, decimal_places=4, default=Decimal('0'))
+    average_value = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    UPDATED_FIELDS = [
+        'quantity', 'fifo_layers', 'fifo_value', 'average_cost',
+        'average_value', 'updated_at'
+    ]
 
     def __str__(self):
-        return f"Inventory for {self.drug.name}"
\ No newline at end of file
+        return f"Valuation for {self.drug_id}"
+
+    def set_figures(self):
+        self.fifo_value = sum(
+            (layer[0] * Decimal(layer[1]) for layer in self.fifo_layers),
+            Decimal('0')
+        ).quantize(Decimal('0.01'))
+        self.average_value = (self.quantity * self.average_cost).quantize(Decimal('0.01'))
+        # bulk_update() leaves auto_now fields alone
+        self.updated_at = now()
+
+    @classmethod
+    def receive(cls, layers):
+        """
+        Add cost layers, a mapping of drug id -> [(quantity, unit cost,
+        order line id)] in receipt order, to the valuation of each drug.
+        """
+        if not layers:
+            return
+        cls.objects.bulk_create(
+            [cls(drug_id=drug_id) for drug_id in layers], ignore_conflicts=True
+        )
+        valuations = list(cls.objects.filter(drug_id__in=layers))
+        for valuation in valuations:
+            for quantity, cost, line_id in layers[valuation.drug_id]:
+                if not quantity:
+                    continue
+                total = valuation.quantity + quantity
+                valuation.average_cost = (
+                    (valuation.quantity * valuation.average_cost + quantity * cost) / total
+                ).quantize(Decimal('0.0001'))
+                valuation.quantity = total
+                valuation.fifo_layers.append([quantity, str(cost), line_id])
+            valuation.set_figures()
+        cls.objects.bulk_update(valuations, cls.UPDATED_FIELDS)
+
+    @classmethod
+    def consume(cls, quantities):
+        """
+        Take ``quantities`` (a mapping of drug id -> units) out of the
+        oldest FIFO layers. Consumption leaves the average cost unchanged.
+        """
+        valuations = list(cls.objects.filter(drug_id__in=quantities, quantity__gt=0))
+        for valuation in valuations:
+            valuation.take_oldest(quantities[valuation.drug_id])
+            valuation.set_figures()
+        cls.objects.bulk_update(valuations, cls.UPDATED_FIELDS)
+
+    @classmethod
+    def write_off(cls, lines):
+        """
+        Take written-off units, a mapping of drug id -> [(order line id or
+        None, units)], out of the layer of each order line, and whatever
+        that layer no longer holds out of the oldest layers.
+        """
+        valuations = list(cls.objects.filter(drug_id__in=lines, quantity__gt=0))
+        for valuation in valuations:
+            for line_id, units in lines[valuation.drug_id]:
+                layers = valuation.fifo_layers
+                for index, layer in enumerate(layers):
+                    if line_id is not None and layer[2:] == [line_id]:
+                        taken = min(units, layer[0])
+                        layer[0] -= taken
+                        valuation.quantity -= taken
+                        units -= taken
+                        if not layer[0]:
+                            del layers[index]
+                        break
+                valuation.take_oldest(units)
+            valuation.set_figures()
+        cls.objects.bulk_update(valuations, cls.UPDATED_FIELDS)
+
+    def take_oldest(self, units):
+        self.quantity = max(self.quantity - units, 0)
+        layers = self.fifo_layers
+        while units and layers:
+            taken = min(units, layers[0][0])
+            layers[0][0] -= taken
+            units -= taken
+            if not layers[0][0]:
+                layers.pop(0)
+
+class StockLotQuerySet(models.QuerySet):
+    def in_stock(self):
+        return self.filter(quantity__gt=0)
+
+    def expired(self, today=None):
+        today = today or localtime(now()).date()
+        return self.in_stock().filter(expiry_date__lt=today)
+
+    def expiring_within(self, days, today=None):
+        today = today or localtime(now()).date()
+        return self.in_stock().filter(
+            expiry_date__gte=today, expiry_date__lte=today + timedelta(days=days)
+        )
+
+class StockLot(models.Model):
+    """
+    A received batch of a drug with its own lot number and expiry date.
+    Lots are created by Order.receive() and drawn down first-expiry-first-out
+    by every sale and usage. Only lots with stock left are indexed on expiry
+    date, so expiry scans stay proportional to the stock actually on hand.
+    """
+    drug = models.ForeignKey(
+        Drug,
+        on_delete=models.CASCADE,
+        related_name='lots'
+    )
+    order_item = models.ForeignKey(
+        OrderItem,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='lots'
+    )
+    lot_number = models.CharField(max_length=50, blank=True, default='')
+    expiry_date = models.DateField(
+        null=True,
+        blank=True,
+        help_text="Empty for stock that does not expire"
+    )
+    quantity = models.PositiveIntegerField(help_text="Units left in this lot")
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    objects = StockLotQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['expiry_date', 'drug'],
+                condition=Q(quantity__gt=0),
+                name='stocklot_expiry_idx'
+            ),
+            models.Index(
+                fields=['drug', 'expiry_date'],
+                condition=Q(quantity__gt=0),
+                name='stocklot_drug_expiry_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Lot {self.lot_number or self.id} of {self.drug_id} ({self.quantity})"
+
+    @classmethod
+    def consume(cls, quantities):
+        """
+        Draw ``quantities`` (a mapping of drug id -> units) from the lots of
+        each drug, earliest expiry first; lots without an expiry date go
+        last. Expired lots are never drawn: they wait to be written off.
+        Units sold beyond the tracked lots, such as stock entered before lot
+        tracking, leave the lots untouched.
+        """
+        today = localtime(now()).date()
+        lots = cls.objects.in_stock().filter(
+            Q(expiry_date__gte=today) | Q(expiry_date__isnull=True),
+            drug_id__in=quantities
+        ).order_by('drug_id', F('expiry_date').asc(nulls_last=True), 'id')
+
+        remaining, changed = dict(quantities), []
+        for lot in lots:
+            if not remaining[lot.drug_id]:
+                continue
+            taken = min(remaining[lot.drug_id], lot.quantity)
+            lot.quantity -= taken
+            remaining[lot.drug_id] -= taken
+            changed.append(lot)
+        cls.objects.bulk_update(changed, ['quantity'])
+
+    @classmethod
+    def write_off_expired(cls, lots=None):
+        """
+        Take the expired lots among ``lots`` (every lot by default) out of
+        stock. Each lot gets a WRITE_OFF transaction for its units, so
+        stock-as-of replays and valuation rebuilds see the loss; stock drops
+        by the same units, the valuation loses them from the lot's own cost
+        layer, and the lots are emptied, which also ends their EXPIRY
+        alerts. Returns the created transactions.
+        """
+        expired = (cls.objects.all() if lots is None else lots).expired()
+        with transaction.atomic():
+            drug_ids = set(expired.values_list('drug_id', flat=True))
+            # Stock first, in drug id order, like every other stock writer
+            Inventory.lock_stock(drug_ids)
+            expired = list(expired.filter(drug_id__in=drug_ids).order_by('drug_id', 'id'))
+            stock = dict(
+                Inventory.objects.filter(drug_id__in=drug_ids)
+                .values_list('drug_id', 'quantity')
+            )
+            written = []
+            for lot in expired:
+                # Stock counted down by hand may already hold less than the lots
+                units = min(lot.quantity, stock.get(lot.drug_id, 0))
+                if units:
+                    stock[lot.drug_id] -= units
+                    written.append((lot, units))
+
+            cls.objects.filter(id__in=[lot.id for lot in expired]).update(quantity=0)
+            quantities, lines = defaultdict(int), defaultdict(list)
+            for lot, units in written:
+                quantities[lot.drug_id] += units
+                lines[lot.drug_id].append((lot.order_item_id, units))
+            update_and_bump(
+                Inventory.objects.filter(drug_id__in=quantities),
+                quantity=F('quantity') - Inventory.per_drug(quantities),
+                last_updated=now()
+            )
+            InventoryValuation.write_off(lines)
+            return Transaction.create_batch([
+                Transaction(
+                    drug_id=lot.drug_id, transaction_type='WRITE_OFF',
+                    quantity=units, lot=lot
+                )
+                for lot, units in written
+            ])
@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+class TimeCreatedCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the append-only tables stamped with ``time_created``.
+    Pages are addressed by an opaque cursor instead of a page number, so there
+    is no COUNT(*) and no OFFSET scan however deep the client pages.
+    """
+    ordering = ('-time_created', '-id')
+
+class CreatedAtCursorPagination(CursorPagination):
+    """Keyset pagination for tables stamped with ``created_at``."""
+    ordering = ('-created_at', '-id')
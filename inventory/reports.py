@@ -0,0 +1,49 @@
+from django.db import models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDay, TruncMonth, TruncWeek
+from .models import PriceHistory
+
+PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+MONEY = models.DecimalField(max_digits=14, decimal_places=2)
+
+def unit_cost_as_of():
+    """
+    Purchase price in effect when the outer transaction happened: the
+    latest PriceHistory row of its drug at or before its time_created.
+    Each lookup is one descending seek on (drug, time_created), the plan a
+    LATERAL join would get. Sales older than the first recorded price fall
+    back to that first price; COALESCE only runs the second lookup then.
+    """
+    prices = PriceHistory.objects.filter(drug=OuterRef('drug')).values('purchase_price')
+    return Coalesce(
+        Subquery(
+            prices.filter(time_created__lte=OuterRef('time_created'))
+            .order_by('-time_created', '-id')[:1]
+        ),
+        Subquery(prices.order_by('time_created', 'id')[:1]),
+    )
+
+def margin_report(transactions, period='month'):
+    """
+    Revenue and cost of goods per drug and period for the sales in
+    ``transactions``, aggregated in a single query. The margin is derived by
+    MarginReportSerializer; computing it in SQL would repeat the price
+    lookups for every row.
+    """
+    return (
+        transactions.filter(transaction_type='SALE')
+        .annotate(period_start=PERIODS[period]('time_created'))
+        .values('drug', 'drug__name', 'period_start')
+        .annotate(
+            # Annotated before quantity is shadowed by its own total
+            revenue=Sum(F('quantity') * F('selling_price'), output_field=MONEY),
+            cost_of_goods=Sum(F('quantity') * unit_cost_as_of(), output_field=MONEY),
+        )
+        .annotate(quantity=Sum('quantity'))
+        .order_by('period_start', 'drug')
+    )
@@ -0,0 +1,84 @@
+import re
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+class DrugSearchFilter(filters.SearchFilter):
+    """
+    Ranked drug search backed by indexes instead of ``icontains`` scans.
+
+    On PostgreSQL it matches prefixes against the generated ``search_vector``
+    tsvector column (GIN indexed) and falls back to pg_trgm similarity on
+    name and SKU for typos, ordering by ts_rank then similarity. Typo
+    matching uses the indexable ``%`` operator, whose cut-off is the
+    database's ``pg_trgm.similarity_threshold`` setting (0.3 by default).
+
+    On SQLite it queries the ``inventory_drug_fts`` FTS5 table ordered by
+    bm25. Both structures are created by migration 0006_drug_search. Other
+    backends keep the stock SearchFilter behaviour.
+    """
+
+    def get_terms(self, request):
+        return [
+            term.lower()
+            for text in self.get_search_terms(request)
+            for term in re.findall(r'\w+', text)
+        ]
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_terms(request)
+        if not terms:
+            return queryset
+        vendor = connections[queryset.db].vendor
+        if vendor == 'postgresql':
+            return self.postgres_search(queryset, terms)
+        if vendor == 'sqlite':
+            return self.sqlite_search(queryset, terms)
+        return super().filter_queryset(request, queryset, view)
+
+    def postgres_search(self, queryset, terms):
+        table = queryset.model._meta.db_table
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        text = ' '.join(terms)
+        matches = RawSQL(
+            f"{table}.search_vector @@ to_tsquery('simple', %s)",
+            [tsquery],
+            output_field=BooleanField()
+        )
+        similar = RawSQL(
+            f'({table}.name %% %s OR {table}."SKU" %% %s)',
+            [text, text],
+            output_field=BooleanField()
+        )
+        return queryset.annotate(
+            search_rank=RawSQL(
+                f"ts_rank({table}.search_vector, to_tsquery('simple', %s))",
+                [tsquery],
+                output_field=FloatField()
+            ),
+            search_similarity=RawSQL(
+                f'GREATEST(similarity({table}.name, %s), '
+                f'similarity({table}."SKU", %s))',
+                [text, text],
+                output_field=FloatField()
+            )
+        ).filter(Q(matches) | Q(similar)).order_by(
+            '-search_rank', '-search_similarity', 'id'
+        )
+
+    def sqlite_search(self, queryset, terms):
+        table = queryset.model._meta.db_table
+        fts = f'{table}_fts'
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", [match])
+        ).annotate(
+            # bm25() is lower for better matches
+            search_rank=RawSQL(
+                f"(SELECT bm25({fts}) FROM {fts} "
+                f"WHERE {fts} MATCH %s AND {fts}.rowid = {table}.id)",
+                [match],
+                output_field=FloatField()
+            )
+        ).order_by('search_rank', 'id')
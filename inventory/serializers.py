@@ -1,10 +1,63 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
+from .categories import get_category_nodes
 from .models import (
     DrugCategory, Drug, Supplier, Order, 
     OrderItem, Transaction, Inventory, 
-    PriceHistory, Notifications
+    PriceHistory, Notifications, InventoryValuation, StockLot,
+    OrderAlreadyReceivedError
 )
 
+class BatchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field that looks related objects up in a batch preloaded by
+    BatchedListSerializer instead of running one query per item.
+    """
+    batch = None
+
+    def to_internal_value(self, data):
+        if self.batch is None:
+            return super().to_internal_value(data)
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in self.batch:
+            self.fail('does_not_exist', pk_value=data)
+        return self.batch[pk]
+
+class BatchedListSerializer(serializers.ListSerializer):
+    """
+    List serializer that resolves every BatchedPrimaryKeyRelatedField of its
+    child with one ``in_bulk`` query per field before validating the items.
+    """
+
+    def to_internal_value(self, data):
+        fields = [
+            field for field in self.child.fields.values()
+            if isinstance(field, BatchedPrimaryKeyRelatedField)
+        ]
+        if isinstance(data, list):
+            for field in fields:
+                model_pk = field.get_queryset().model._meta.pk
+                pks = set()
+                for item in data:
+                    if not isinstance(item, dict):
+                        continue
+                    try:
+                        pks.add(model_pk.to_python(item.get(field.field_name)))
+                    except (TypeError, ValueError, DjangoValidationError):
+                        continue
+                pks.discard(None)
+                field.batch = field.get_queryset().in_bulk(pks)
+        try:
+            return super().to_internal_value(data)
+        finally:
+            for field in fields:
+                field.batch = None
+
 class DrugCategorySerializer(serializers.ModelSerializer):
     subcategories = serializers.SerializerMethodField()
     
@@ -13,7 +66,11 @@ class DrugCategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'parent_category', 'subcategories']
 
     def get_subcategories(self, obj):
-        return DrugCategorySerializer(obj.subcategories.all(), many=True).data
+        # The whole hierarchy is loaded once per response, not once per node
+        if 'category_nodes' not in self.context:
+            self.context['category_nodes'] = get_category_nodes()
+        node = self.context['category_nodes'].get(obj.id)
+        return node['subcategories'] if node else []
 
 class PriceHistorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -26,16 +83,46 @@ class InventorySerializer(serializers.ModelSerializer):
         fields = ['id', 'drug', 'quantity', 'reorder_level', 
                  'time_created', 'last_updated']
 
+class InventoryValuationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = InventoryValuation
+        fields = ['drug', 'quantity', 'fifo_value', 'fifo_layers',
+                 'average_cost', 'average_value', 'updated_at']
+
+class StockLotSerializer(serializers.ModelSerializer):
+    drug_name = serializers.CharField(source='drug.name', read_only=True)
+
+    class Meta:
+        model = StockLot
+        fields = ['id', 'drug', 'drug_name', 'order_item', 'lot_number',
+                 'expiry_date', 'quantity', 'received_at']
+
 class DrugSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     inventory = InventorySerializer(read_only=True)
-    price_history = PriceHistorySerializer(many=True, read_only=True)
+    current_price = serializers.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        read_only=True,
+        allow_null=True
+    )
+    price_history = serializers.SerializerMethodField()
     
     class Meta:
         model = Drug
         fields = ['id', 'name', 'description', 'SKU', 'category', 
                  'category_name', 'dispense_unit', 'inventory', 
-                 'price_history']
+                 'current_price', 'price_history']
+
+    def get_price_history(self, obj):
+        # Only the latest prices are embedded; the full series is paged
+        # through /api/price-history/?drug=
+        prices = getattr(obj, 'latest_prices', None)
+        if prices is None:
+            prices = obj.price_history.order_by('-time_created', '-id')[
+                :settings.PRICE_HISTORY_PREVIEW_LIMIT
+            ]
+        return PriceHistorySerializer(prices, many=True).data
 
 class SupplierSerializer(serializers.ModelSerializer):
     class Meta:
@@ -44,32 +131,106 @@ class SupplierSerializer(serializers.ModelSerializer):
                  'email', 'address', 'created_at']
 
 class OrderItemSerializer(serializers.ModelSerializer):
+    drug = BatchedPrimaryKeyRelatedField(queryset=Drug.objects.all())
     drug_name = serializers.CharField(source='drug.name', read_only=True)
     drug_sku = serializers.CharField(source='drug.SKU', read_only=True)
     
     class Meta:
         model = OrderItem
         fields = ['id', 'order', 'drug', 'drug_name', 'drug_sku', 
-                 'quantity', 'purchase_price']
+                 'quantity', 'purchase_price', 'lot_number', 'expiry_date']
+        list_serializer_class = BatchedListSerializer
+
+    def validate(self, attrs):
+        # Received lines are already booked into stock, valuation and lots
+        orders = [attrs.get('order'), getattr(self.instance, 'order', None)]
+        if any(order is not None and order.status == 'RECEIVED' for order in orders):
+            raise serializers.ValidationError(
+                "Lines of a received order cannot be changed"
+            )
+        return attrs
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Lines nested in OrderSerializer take their order from the parent
+        if isinstance(self.parent, serializers.ListSerializer) and self.parent.parent:
+            fields['order'].read_only = True
+        return fields
 
 class OrderSerializer(serializers.ModelSerializer):
-    items = OrderItemSerializer(many=True, read_only=True)
+    items = OrderItemSerializer(many=True, required=False)
     supplier_name = serializers.CharField(source='supplier.name', read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     
     class Meta:
         model = Order
         fields = ['id', 'supplier', 'supplier_name', 'status', 
-                 'status_display', 'time_created', 'items']
+                 'status_display', 'time_created', 'received_at', 'items']
+        read_only_fields = ['received_at']
+
+    def validate(self, attrs):
+        if self.instance is not None and self.instance.status == 'RECEIVED':
+            if attrs.get('status', 'RECEIVED') != 'RECEIVED' or 'items' in attrs:
+                raise serializers.ValidationError(
+                    "A received order cannot be changed"
+                )
+        return attrs
 
     def create(self, validated_data):
-        items_data = self.context['request'].data.get('items', [])
-        order = Order.objects.create(**validated_data)
-        for item_data in items_data:
-            OrderItem.objects.create(order=order, **item_data)
+        items_data = validated_data.pop('items', [])
+        # Stock is only booked through Order.receive()
+        receive = validated_data.get('status') == 'RECEIVED'
+        if receive:
+            validated_data['status'] = 'PLACED'
+        with transaction.atomic():
+            order = Order.objects.create(**validated_data)
+            self._save_items(order, items_data)
+            if receive:
+                order.receive()
         return order
 
+    def update(self, instance, validated_data):
+        items_data = validated_data.pop('items', None)
+        receive = (
+            validated_data.get('status') == 'RECEIVED'
+            and instance.status != 'RECEIVED'
+        )
+        if receive:
+            del validated_data['status']
+        with transaction.atomic():
+            # Re-check under the row lock: a receipt may have committed since
+            # the order was read, and saving the stale row would undo it
+            locked = Order.objects.select_for_update().get(pk=instance.pk)
+            if locked.status == 'RECEIVED':
+                if receive:
+                    raise OrderAlreadyReceivedError(instance.pk)
+                if (validated_data.get('status', 'RECEIVED') != 'RECEIVED'
+                        or items_data is not None):
+                    raise serializers.ValidationError(
+                        "A received order cannot be changed"
+                    )
+            instance.status, instance.received_at = locked.status, locked.received_at
+            instance = super().update(instance, validated_data)
+            if items_data is not None:
+                instance.items.all().delete()
+                self._save_items(instance, items_data)
+            if receive:
+                instance.receive()
+        return instance
+
+    def _save_items(self, order, items_data):
+        items = OrderItem.objects.bulk_create(
+            [OrderItem(order=order, **item) for item in items_data]
+        )
+        # Serve the response from the lines just written instead of
+        # querying them back; their drugs were loaded during validation
+        prefetched = order.items.all()
+        prefetched._result_cache = items
+        prefetched._prefetch_done = True
+        order._prefetched_objects_cache = {'items': prefetched}
+
 class TransactionSerializer(serializers.ModelSerializer):
+    drug = BatchedPrimaryKeyRelatedField(queryset=Drug.objects.all())
     drug_name = serializers.CharField(source='drug.name', read_only=True)
     drug_sku = serializers.CharField(source='drug.SKU', read_only=True)
     transaction_type_display = serializers.CharField(
@@ -81,7 +242,41 @@ class TransactionSerializer(serializers.ModelSerializer):
         model = Transaction
         fields = ['id', 'drug', 'drug_name', 'drug_sku', 
                  'transaction_type', 'transaction_type_display',
-                 'quantity', 'selling_price', 'time_created']
+                 'quantity', 'selling_price', 'lot', 'time_created']
+        read_only_fields = ['lot']
+        list_serializer_class = BatchedListSerializer
+
+    def validate_transaction_type(self, value):
+        # Write-offs empty expired lots rather than drawing on the freshest
+        if value == 'WRITE_OFF':
+            raise serializers.ValidationError(
+                "Expired stock is written off through /api/inventory/write_off_expired/"
+            )
+        return value
+
+class TransactionRollupSeriesSerializer(serializers.Serializer):
+    period_start = serializers.DateTimeField()
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    count = serializers.IntegerField()
+
+class MarginReportSerializer(serializers.Serializer):
+    drug = serializers.IntegerField()
+    drug_name = serializers.CharField(source='drug__name')
+    period_start = serializers.DateTimeField()
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2, allow_null=True)
+    cost_of_goods = serializers.DecimalField(
+        max_digits=14, decimal_places=2, allow_null=True
+    )
+    margin = serializers.DecimalField(max_digits=14, decimal_places=2, allow_null=True)
+
+    def to_representation(self, instance):
+        cost = instance['cost_of_goods']
+        margin = None
+        if cost is not None:
+            margin = (instance['revenue'] or 0) - cost
+        return super().to_representation({**instance, 'margin': margin})
 
 class NotificationsSerializer(serializers.ModelSerializer):
     drug_name = serializers.CharField(source='drug.name', read_only=True)
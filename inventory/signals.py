@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from .autocomplete import drug_prefix_index
+from .cache import bump_model_version
+from .categories import invalidate_category_tree
+from .models import (
+    DrugCategory, Drug, Inventory, PriceHistory, Supplier,
+    Transaction, TransactionRollup
+)
+
+@receiver([post_save, post_delete], sender=DrugCategory)
+def drug_category_changed(sender, **kwargs):
+    invalidate_category_tree()
+    # Drop anything another request cached from pre-commit data as well
+    transaction.on_commit(invalidate_category_tree)
+
+def catalog_changed(sender, **kwargs):
+    bump_model_version(sender)
+
+for catalog_model in (Drug, DrugCategory, Inventory, PriceHistory, Supplier):
+    post_save.connect(catalog_changed, sender=catalog_model)
+    post_delete.connect(catalog_changed, sender=catalog_model)
+
+# The index only ever sees committed data: a rolled-back save never reaches it
+@receiver(post_save, sender=Drug)
+def drug_saved(sender, instance, **kwargs):
+    drug_id, sku, name = instance.id, instance.SKU, instance.name
+    transaction.on_commit(lambda: drug_prefix_index.committed(drug_id, sku, name))
+
+@receiver(post_delete, sender=Drug)
+def drug_deleted(sender, instance, **kwargs):
+    drug_id = instance.id
+    transaction.on_commit(lambda: drug_prefix_index.committed(drug_id))
+
+@receiver(pre_save, sender=Transaction)
+def transaction_pre_save(sender, instance, **kwargs):
+    # Remember what the rollups currently hold for an edited transaction
+    if instance.pk and not kwargs.get('raw'):
+        instance._rollup_previous = Transaction.objects.filter(pk=instance.pk).first()
+
+@receiver(post_save, sender=Transaction)
+def transaction_saved(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous is not None:
+        TransactionRollup.record([previous], sign=-1)
+        instance._rollup_previous = None
+    TransactionRollup.record([instance])
+
+@receiver(post_delete, sender=Transaction)
+def transaction_deleted(sender, instance, **kwargs):
+    TransactionRollup.record([instance], sign=-1)
@@ -1,3 +1,1447 @@
-from django.test import TestCase
+import json
+import math
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from smtplib import SMTPException
+from statistics import NormalDist
+from unittest import mock, skipUnless
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection, transaction
+from django.db.models import F, Q, Sum
+from django.test import (
+    AsyncClient, TestCase, TransactionTestCase, override_settings,
+    skipUnlessDBFeature
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from rest_framework import serializers
+from rest_framework.test import APIClient
+from .models import (
+    DrugCategory, Drug, Supplier, Order, OrderItem, Transaction, Inventory,
+    PriceHistory, Notifications, EmailOutbox, InventoryValuation, StockLot,
+    StockSnapshot, TransactionRollup, OrderAlreadyReceivedError
+)
+from .autocomplete import INDEX_VERSION_KEY
+from .cache import get_or_recompute
+from .forecasting import (
+    apply_reorder_levels, daily_demand, forecast, recommend_reorder_levels
+)
+from .metrics import QUERY_COUNT
+from .pagination import TimeCreatedCursorPagination, CreatedAtCursorPagination
+from .reports import margin_report
+from .serializers import OrderSerializer
+from .valuation import rebuild_valuations
+from .views import (
+    drug_queryset, TransactionViewSet, PriceHistoryViewSet,
+    NotificationsViewSet, OrderViewSet
+)
 
-# Create your tests here.
+# Tables that grow without bound in production and must never be read
+# with a full scan on a hot path
+LARGE_TABLES = [
+    model._meta.db_table
+    for model in (Transaction, PriceHistory, Notifications, Order, Inventory, StockLot)
+]
+
+def create_drug(category, sku, quantity=100, reorder_level=0, name=None):
+    drug = Drug.objects.create(
+        category=category, name=name or sku.title(), description='',
+        SKU=sku, dispense_unit='BOX'
+    )
+    Inventory.objects.create(drug=drug, quantity=quantity, reorder_level=reorder_level)
+    return drug
+
+def app_queries(queries):
+    """Captured queries against this app's tables, leaving out cache reads."""
+    return [query for query in queries.captured_queries if '"inventory_' in query['sql']]
+
+class APITestCase(TestCase):
+    """Behaviour tests that call the API as an authenticated user."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='staff')
+        cls.category = DrugCategory.objects.create(name='Analgesics')
+
+    def setUp(self):
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(self.user)
+
+@skipUnless(
+    connection.vendor in ('postgresql', 'sqlite'),
+    "Query plan checks understand PostgreSQL and SQLite EXPLAIN output only"
+)
+class QueryPlanTests(TestCase):
+    """
+    Runs EXPLAIN on the main query of each viewset and fails when the plan
+    falls back to a sequential scan on one of the large tables. Sequential
+    scans are priced out on PostgreSQL so the planner picks an index
+    whenever one can serve the query, whatever the test table sizes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = DrugCategory.objects.create(name='Analgesics')
+        cls.drug = Drug.objects.create(
+            category=category, name='Paracetamol', description='',
+            SKU='PARA-500', dispense_unit='TABLET'
+        )
+        Inventory.objects.create(drug=cls.drug, quantity=5, reorder_level=10)
+        PriceHistory.objects.create(drug=cls.drug, purchase_price='1.20')
+        Transaction.objects.create(
+            drug=cls.drug, transaction_type='SALE', quantity=2,
+            selling_price='2.50'
+        )
+        Notifications.objects.create(
+            drug=cls.drug, notification_type='LOW_STOCK', message='Low stock'
+        )
+        supplier = Supplier.objects.create(
+            name='Acme', contact_person='Jane', telephone='123',
+            email='acme@example.com', address='1 Street'
+        )
+        Order.objects.create(supplier=supplier)
+        StockLot.objects.create(
+            drug=cls.drug, lot_number='L1', quantity=5,
+            expiry_date=now().date() + timedelta(days=10)
+        )
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def explain(self, queryset):
+        # Built by hand: QuerySet.explain() misplaces the EXPLAIN prefix for
+        # queries that filter on a window function
+        sql, params = queryset.query.sql_with_params()
+        prefix = 'EXPLAIN' if connection.vendor == 'postgresql' else 'EXPLAIN QUERY PLAN'
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            return "\n".join(str(row[-1]) for row in cursor.fetchall())
+
+    def assertUsesIndexes(self, queryset):
+        plan = self.explain(queryset)
+        for table in LARGE_TABLES:
+            if connection.vendor == 'postgresql':
+                pattern = rf'Seq Scan on {table}\b'
+            else:
+                pattern = rf'\bSCAN {table}\b(?! USING)'
+            self.assertIsNone(
+                re.search(pattern, plan),
+                f"Sequential scan on {table}:\n{plan}"
+            )
+
+    def test_transaction_list_page(self):
+        queryset = TransactionViewSet().get_queryset().order_by(
+            *TimeCreatedCursorPagination.ordering
+        )
+        self.assertUsesIndexes(queryset[:10])
+
+    def test_transactions_for_drug_in_date_range(self):
+        queryset = TransactionViewSet().get_queryset().filter(
+            drug=self.drug,
+            time_created__range=[now() - timedelta(days=30), now()]
+        )
+        self.assertUsesIndexes(queryset)
+
+    def test_price_history_for_drug(self):
+        queryset = PriceHistoryViewSet().get_queryset().filter(drug=self.drug)
+        self.assertUsesIndexes(queryset[:10])
+
+    def test_price_history_list_page(self):
+        queryset = PriceHistoryViewSet().get_queryset().order_by(
+            *TimeCreatedCursorPagination.ordering
+        )
+        self.assertUsesIndexes(queryset[:10])
+
+    def test_drug_list_latest_prices(self):
+        prefetch = drug_queryset()._prefetch_related_lookups[0]
+        self.assertUsesIndexes(prefetch.queryset.filter(drug__in=[self.drug.id]))
+
+    def test_unread_alert_lookup(self):
+        queryset = Notifications.objects.filter(
+            drug=self.drug, notification_type='LOW_STOCK', is_read=False
+        )
+        self.assertUsesIndexes(queryset)
+
+    def test_notification_list_page(self):
+        queryset = NotificationsViewSet().get_queryset().order_by(
+            *CreatedAtCursorPagination.ordering
+        )
+        self.assertUsesIndexes(queryset[:10])
+
+    def test_orders_by_status(self):
+        queryset = OrderViewSet().get_queryset().filter(
+            status='PLACED'
+        ).order_by('-time_created')
+        self.assertUsesIndexes(queryset[:10])
+
+    def test_margin_report_price_lookups(self):
+        queryset = margin_report(Transaction.objects.filter(
+            time_created__range=[now() - timedelta(days=30), now()]
+        ))
+        self.assertUsesIndexes(queryset)
+
+    def test_low_stock_inventory(self):
+        queryset = Inventory.objects.filter(quantity__lte=F('reorder_level'))
+        self.assertUsesIndexes(queryset)
+
+    def test_expired_lots(self):
+        self.assertUsesIndexes(StockLot.objects.expired().order_by('expiry_date', 'id'))
+
+    def test_expiring_lots(self):
+        queryset = StockLot.objects.expiring_within(30).order_by('expiry_date', 'id')
+        self.assertUsesIndexes(queryset)
+
+    def test_lots_consumed_for_drug(self):
+        queryset = StockLot.objects.in_stock().filter(
+            Q(expiry_date__gte=now().date()) | Q(expiry_date__isnull=True),
+            drug_id__in=[self.drug.id]
+        )
+        self.assertUsesIndexes(queryset)
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentStockTests(TransactionTestCase):
+    """
+    Fires thousands of sales at the transactions endpoint from many threads
+    at once and checks that stock ends exactly where the accepted sales say.
+    """
+    THREADS = 16
+    SALES = 2000
+
+    def setUp(self):
+        category = DrugCategory.objects.create(name='Analgesics')
+        self.user = User.objects.create(username='pos')
+        self.scarce = Drug.objects.create(
+            category=category, name='Scarce', description='',
+            SKU='SCARCE', dispense_unit='BOX'
+        )
+        self.plentiful = Drug.objects.create(
+            category=category, name='Plentiful', description='',
+            SKU='PLENTY', dispense_unit='BOX'
+        )
+        Inventory.objects.create(drug=self.scarce, quantity=1500, reorder_level=0)
+        Inventory.objects.create(drug=self.plentiful, quantity=10000, reorder_level=0)
+
+    def sell(self, number):
+        client = APIClient(HTTP_HOST='localhost')
+        client.force_authenticate(self.user)
+        drug = self.scarce if number % 2 else self.plentiful
+        try:
+            response = client.post('/api/transactions/', {
+                'drug': drug.id,
+                'transaction_type': 'SALE',
+                'quantity': 2,
+                'selling_price': '1.00',
+            }, format='json')
+            return drug.id, response.status_code
+        finally:
+            connection.close()
+
+    def test_parallel_sales_keep_exact_stock(self):
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            results = list(pool.map(self.sell, range(self.SALES)))
+
+        self.assertTrue(all(code in (201, 400) for _, code in results))
+        for drug, initial in ((self.scarce, 1500), (self.plentiful, 10000)):
+            accepted = sum(
+                1 for drug_id, code in results if drug_id == drug.id and code == 201
+            )
+            self.assertEqual(
+                Transaction.objects.filter(drug=drug).count(), accepted
+            )
+            self.assertEqual(
+                Inventory.objects.get(drug=drug).quantity, initial - 2 * accepted
+            )
+        # 1000 sales of 2 against 1500 units: exactly 750 can go through
+        self.assertEqual(Inventory.objects.get(drug=self.scarce).quantity, 0)
+        self.assertEqual(Inventory.objects.get(drug=self.plentiful).quantity, 8000)
+
+    def test_single_and_bulk_sales_queue_instead_of_deadlocking(self):
+        # Bulk uploads list the drugs in the opposite order to the single
+        # sales, so any writer locking rollups before inventory would deadlock
+        def sell(number):
+            client = APIClient(HTTP_HOST='localhost')
+            client.force_authenticate(self.user)
+            try:
+                if number % 2:
+                    drug = self.scarce if number % 4 == 1 else self.plentiful
+                    response = client.post('/api/transactions/', {
+                        'drug': drug.id, 'transaction_type': 'SALE',
+                        'quantity': 2, 'selling_price': '1.00',
+                    }, format='json')
+                else:
+                    response = client.post('/api/transactions/bulk/', [
+                        {'drug': drug.id, 'transaction_type': 'SALE',
+                         'quantity': 2, 'selling_price': '1.00'}
+                        for drug in (self.plentiful, self.scarce)
+                    ], format='json')
+                return response.status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            codes = list(pool.map(sell, range(self.SALES // 4)))
+
+        self.assertTrue(all(code in (201, 400) for code in codes))
+        for drug, initial in ((self.scarce, 1500), (self.plentiful, 10000)):
+            sold = Transaction.objects.filter(drug=drug).aggregate(
+                total=Sum('quantity')
+            )['total'] or 0
+            self.assertEqual(Inventory.objects.get(drug=drug).quantity, initial - sold)
+            self.assertEqual(
+                TransactionRollup.objects.filter(drug=drug, granularity='DAY')
+                .aggregate(total=Sum('quantity'))['total'] or 0,
+                sold
+            )
+
+    def test_concurrent_receipts_book_the_order_once(self):
+        supplier = Supplier.objects.create(
+            name='Acme', contact_person='Jane', telephone='123',
+            email='acme@example.com', address='1 Street'
+        )
+        order = Order.objects.create(supplier=supplier)
+        OrderItem.objects.create(
+            order=order, drug=self.scarce, quantity=100, purchase_price='1.00'
+        )
+
+        def receive(_):
+            client = APIClient(HTTP_HOST='localhost')
+            client.force_authenticate(self.user)
+            try:
+                return client.post(
+                    f'/api/orders/{order.id}/update_status/', {'status': 'RECEIVED'}
+                ).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            codes = list(pool.map(receive, range(self.THREADS)))
+
+        self.assertEqual(sorted(codes), [200] + [409] * (self.THREADS - 1))
+        self.assertEqual(Inventory.objects.get(drug=self.scarce).quantity, 1600)
+
+    def test_concurrent_replenishment_drafts_each_shortfall_once(self):
+        supplier = Supplier.objects.create(
+            name='Acme', contact_person='Jane', telephone='123',
+            email='acme@example.com', address='1 Street'
+        )
+        received = Order.objects.create(supplier=supplier, status='RECEIVED')
+        OrderItem.objects.create(
+            order=received, drug=self.scarce, quantity=100, purchase_price='1.00'
+        )
+        Inventory.objects.filter(drug=self.scarce).update(reorder_level=2000)
+
+        def replenish(_):
+            try:
+                return len(Order.create_replenishment_orders()[0])
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            created = list(pool.map(replenish, range(self.THREADS)))
+
+        self.assertEqual(sum(created), 1)
+        self.assertEqual(
+            OrderItem.objects.filter(order__status='DRAFT').aggregate(
+                total=Sum('quantity')
+            )['total'],
+            2000 * 2 - 1500
+        )
+
+    def test_concurrent_patches_receive_the_order_once(self):
+        supplier = Supplier.objects.create(
+            name='Acme', contact_person='Jane', telephone='123',
+            email='acme@example.com', address='1 Street'
+        )
+        order = Order.objects.create(supplier=supplier)
+        OrderItem.objects.create(
+            order=order, drug=self.scarce, quantity=100, purchase_price='1.00'
+        )
+
+        def patch(number):
+            client = APIClient(HTTP_HOST='localhost')
+            client.force_authenticate(self.user)
+            try:
+                # Half the requests move the order back to IN_PROGRESS
+                new_status = 'RECEIVED' if number % 2 else 'IN_PROGRESS'
+                return new_status, client.patch(
+                    f'/api/orders/{order.id}/', {'status': new_status}
+                ).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            results = list(pool.map(patch, range(self.THREADS)))
+
+        self.assertEqual(
+            sum(1 for new_status, code in results if new_status == 'RECEIVED' and code == 200),
+            1
+        )
+        self.assertTrue(all(code in (200, 400, 409) for _, code in results))
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'RECEIVED')
+        self.assertEqual(Inventory.objects.get(drug=self.scarce).quantity, 1600)
+
+class TransactionRollupTests(APITestCase):
+    def test_sales_edits_and_deletes_move_the_buckets(self):
+        drug = create_drug(self.category, 'IBU')
+        sale = Transaction.objects.create(
+            drug=drug, transaction_type='SALE', quantity=3, selling_price='2.50'
+        )
+        sale.quantity = 4
+        sale.save()
+        Transaction.objects.create(drug=drug, transaction_type='USAGE', quantity=1)
+
+        day = TransactionRollup.objects.get(
+            drug=drug, granularity='DAY', transaction_type='SALE'
+        )
+        self.assertEqual((day.quantity, day.revenue, day.count), (4, Decimal('10.00'), 1))
+
+        sale.delete()
+        day.refresh_from_db()
+        self.assertEqual((day.quantity, day.revenue, day.count), (0, Decimal('0.00'), 0))
+        response = self.client.get(
+            '/api/transactions/timeseries/', {'drug': drug.id, 'bucket': 'hour'}
+        )
+        self.assertEqual([row['quantity'] for row in response.data], [1])
+
+    def test_transactions_cannot_be_edited_or_deleted(self):
+        drug = create_drug(self.category, 'IBU', quantity=10)
+        sale = self.client.post('/api/transactions/', {
+            'drug': drug.id, 'transaction_type': 'SALE', 'quantity': 2,
+        }, format='json').data
+        url = f"/api/transactions/{sale['id']}/"
+
+        self.assertEqual(self.client.patch(url, {'quantity': 5}).status_code, 405)
+        self.assertEqual(self.client.delete(url).status_code, 405)
+        self.assertEqual(Inventory.objects.get(drug=drug).quantity, 8)
+
+    def test_timeseries_rejects_malformed_filters(self):
+        for params in ({'drug': 'abc'}, {'start_date': 'garbage'},
+                       {'end_date': '2024-02-30'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/transactions/timeseries/', params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.data)
+        response = self.client.get(
+            '/api/transactions/timeseries/', {'start_date': '2024-01-01'}
+        )
+        self.assertEqual(response.status_code, 200)
+
+class BulkTransactionTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.aspirin = create_drug(cls.category, 'ASP', quantity=10)
+        cls.codeine = create_drug(cls.category, 'COD', quantity=3)
+
+    def post_bulk(self, items):
+        return self.client.post('/api/transactions/bulk/', items, format='json')
+
+    def test_batch_is_booked_with_one_drug_lookup(self):
+        items = [
+            {'drug': self.aspirin.id, 'transaction_type': 'SALE',
+             'quantity': 2, 'selling_price': '1.50'},
+            {'drug': self.codeine.id, 'transaction_type': 'USAGE', 'quantity': 1},
+            {'drug': self.aspirin.id, 'transaction_type': 'SALE',
+             'quantity': 3, 'selling_price': '1.50'},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_bulk(items)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([row['drug_sku'] for row in response.data], ['ASP', 'COD', 'ASP'])
+        drug_reads = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and 'FROM "inventory_drug"' in query['sql']
+        ]
+        self.assertEqual(len(drug_reads), 1)
+        self.assertEqual(Inventory.objects.get(drug=self.aspirin).quantity, 5)
+        self.assertEqual(Inventory.objects.get(drug=self.codeine).quantity, 2)
+        self.assertEqual(
+            TransactionRollup.objects.get(
+                drug=self.aspirin, granularity='DAY', transaction_type='SALE'
+            ).quantity,
+            5
+        )
+
+    def test_rows_are_stamped_after_the_stock_lock(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_bulk([
+                {'drug': self.aspirin.id, 'transaction_type': 'SALE', 'quantity': 1},
+                {'drug': self.codeine.id, 'transaction_type': 'SALE', 'quantity': 1},
+            ])
+        self.assertEqual(response.status_code, 201)
+        statements = [query['sql'] for query in queries.captured_queries]
+        stock_update = next(
+            index for index, sql in enumerate(statements)
+            if sql.startswith('UPDATE "inventory_inventory"')
+        )
+        insert = next(
+            index for index, sql in enumerate(statements)
+            if sql.startswith('INSERT INTO "inventory_transaction"')
+        )
+        self.assertLess(stock_update, insert)
+
+    def test_shortage_rejects_the_whole_batch(self):
+        response = self.post_bulk([
+            {'drug': self.aspirin.id, 'transaction_type': 'SALE', 'quantity': 2},
+            {'drug': self.codeine.id, 'transaction_type': 'SALE', 'quantity': 2},
+            {'drug': self.codeine.id, 'transaction_type': 'SALE', 'quantity': 2},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['shortages'],
+            {self.codeine.id: {'requested': 4, 'available': 3}}
+        )
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(TransactionRollup.objects.exists())
+        self.assertEqual(Inventory.objects.get(drug=self.aspirin).quantity, 10)
+
+    def test_invalid_items_are_reported_per_item(self):
+        response = self.post_bulk([
+            {'drug': self.aspirin.id, 'transaction_type': 'SALE', 'quantity': 1},
+            {'drug': 999999, 'transaction_type': 'SALE', 'quantity': 1},
+            {'drug': self.aspirin.id, 'transaction_type': 'REFUND', 'quantity': -1},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual(list(response.data[1]), ['drug'])
+        self.assertEqual(set(response.data[2]), {'transaction_type', 'quantity'})
+        self.assertFalse(Transaction.objects.exists())
+
+class CursorPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        drug = create_drug(cls.category, 'ASP')
+        Transaction.objects.bulk_create([
+            Transaction(drug=drug, transaction_type='SALE', quantity=1)
+            for _ in range(25)
+        ])
+        PriceHistory.objects.bulk_create([
+            PriceHistory(drug=drug, purchase_price='1.00') for _ in range(25)
+        ])
+        Notifications.objects.bulk_create([
+            Notifications(drug=drug, notification_type='LOW_STOCK', message='Low')
+            for _ in range(25)
+        ])
+
+    def page_through(self, url):
+        ids = []
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('count', response.data)
+                ids.extend(row['id'] for row in response.data['results'])
+                url = response.data['next']
+        self.assertFalse(
+            [query for query in queries.captured_queries if 'COUNT(' in query['sql']]
+        )
+        return ids
+
+    def test_pages_cover_every_row_newest_first(self):
+        for url, model in (
+            ('/api/transactions/', Transaction),
+            ('/api/price-history/', PriceHistory),
+            ('/api/notifications/', Notifications),
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.page_through(url),
+                    sorted(model.objects.values_list('id', flat=True), reverse=True)
+                )
+
+class CategoryTreeTests(APITestCase):
+    def test_tree_is_built_in_one_query_and_follows_writes(self):
+        tablets = DrugCategory.objects.create(name='Tablets', parent_category=self.category)
+        DrugCategory.objects.create(name='Coated', parent_category=tablets)
+
+        with CaptureQueriesContext(connection) as queries:
+            tree = self.client.get('/api/drug-categories/tree/').data
+        self.assertEqual(
+            sum('"inventory_drugcategory"' in query['sql']
+                for query in queries.captured_queries),
+            1
+        )
+        self.assertEqual(tree[0]['name'], 'Analgesics')
+        self.assertEqual(tree[0]['subcategories'][0]['subcategories'][0]['name'], 'Coated')
+
+        tablets.parent_category = None
+        tablets.save()
+        tree = self.client.get('/api/drug-categories/tree/').data
+        self.assertEqual([node['name'] for node in tree], ['Analgesics', 'Tablets'])
+
+class DrugPriceTests(APITestCase):
+    def create_priced_drug(self, sku, prices):
+        drug = create_drug(self.category, sku)
+        for price in prices:
+            PriceHistory.objects.create(drug=drug, purchase_price=price)
+        return drug
+
+    def test_only_the_latest_prices_are_embedded(self):
+        prices = [f'{value}.00' for value in range(1, 9)]
+        drug = self.create_priced_drug('ASP', prices)
+
+        data = self.client.get(f'/api/drugs/{drug.id}/').data
+        self.assertEqual(data['current_price'], '8.00')
+        self.assertEqual(
+            [row['purchase_price'] for row in data['price_history']],
+            prices[::-1][:settings.PRICE_HISTORY_PREVIEW_LIMIT]
+        )
+
+    def test_drug_list_queries_do_not_grow_with_the_page(self):
+        counts = []
+        for batch in range(2):
+            for number in range(3):
+                self.create_priced_drug(f'D{batch}{number}', ['1.00', '2.00'])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/drugs/')
+            self.assertEqual(response.data['results'][0]['current_price'], '2.00')
+            counts.append(len(app_queries(queries)))
+        self.assertEqual(counts[0], counts[1])
+
+class LowStockScanTests(APITestCase):
+    def test_scan_alerts_each_breaching_drug_once(self):
+        low = create_drug(self.category, 'LOW', quantity=2, reorder_level=5)
+        at_level = create_drug(self.category, 'EDGE', quantity=5, reorder_level=5)
+        create_drug(self.category, 'OK', quantity=6, reorder_level=5)
+
+        response = self.client.post('/api/inventory/scan_low_stock/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual({row['drug'] for row in response.data}, {low.id, at_level.id})
+        self.assertEqual(EmailOutbox.objects.count(), 2)
+
+        self.assertEqual(self.client.post('/api/inventory/scan_low_stock/').data, [])
+
+        Notifications.objects.filter(drug=low).update(is_read=True)
+        response = self.client.post('/api/inventory/scan_low_stock/')
+        self.assertEqual([row['drug'] for row in response.data], [low.id])
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise SMTPException('Relay refused')
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class EmailOutboxTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.drugs = [
+            create_drug(cls.category, sku, quantity=0, reorder_level=5)
+            for sku in ('ASP', 'IBU', 'COD')
+        ]
+
+    def test_pending_emails_go_out_as_one_digest_per_recipient(self):
+        alerts = Notifications.create_low_stock_alerts()
+        EmailOutbox.enqueue(alerts[:1], recipient='pharmacist@example.com')
+
+        self.assertEqual(EmailOutbox.deliver_pending(), 4)
+        self.assertEqual(
+            {(message.to[0], message.subject) for message in mail.outbox},
+            {
+                (settings.ADMIN_EMAIL, '3 inventory alerts'),
+                ('pharmacist@example.com', f'Low Stock Alert - {alerts[0].drug.name}'),
+            }
+        )
+        self.assertFalse(EmailOutbox.objects.filter(sent_at__isnull=True).exists())
+        self.assertEqual(EmailOutbox.deliver_pending(), 0)
+        self.assertEqual(len(mail.outbox), 2)
+
+    @override_settings(EMAIL_BACKEND='inventory.tests.FailingEmailBackend')
+    def test_failures_are_recorded_until_attempts_run_out(self):
+        Notifications.create_low_stock_alerts()
+
+        for _ in range(3):
+            self.assertEqual(EmailOutbox.deliver_pending(max_attempts=2), 0)
+        self.assertEqual(
+            set(EmailOutbox.objects.values_list('attempts', 'last_error', 'sent_at')),
+            {(2, 'Relay refused', None)}
+        )
+
+    def test_outbox_rows_commit_with_their_notification(self):
+        with mock.patch.object(EmailOutbox, 'enqueue', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                Notifications.create_low_stock_alerts()
+        self.assertFalse(Notifications.objects.exists())
+
+        Notifications.create_low_stock_alerts()
+        self.assertEqual(
+            set(EmailOutbox.objects.values_list('notification__drug', flat=True)),
+            {drug.id for drug in self.drugs}
+        )
+
+class ResponseCacheTests(APITestCase):
+    def create_supplier(self, name):
+        return Supplier.objects.create(
+            name=name, contact_person='Jane', telephone='123',
+            email='supplier@example.com', address='1 Street'
+        )
+
+    def test_matching_etag_gets_304_until_a_write(self):
+        self.create_supplier('Acme')
+        etag = self.client.get('/api/suppliers/')['ETag']
+
+        response = self.client.get('/api/suppliers/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.create_supplier('Globex')
+        response = self.client.get('/api/suppliers/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+
+    def test_responses_cached_before_commit_are_dropped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_supplier('Acme')
+            # Cached while the write is not yet committed
+            before_commit = self.client.get('/api/suppliers/')['ETag']
+        self.assertNotEqual(self.client.get('/api/suppliers/')['ETag'], before_commit)
+
+class ExportTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.drug = create_drug(cls.category, 'ASP')
+        other = create_drug(cls.category, 'IBU')
+        for drug, quantity, price in ((cls.drug, 2, '1.50'), (other, 1, None),
+                                      (cls.drug, 4, '1.25')):
+            Transaction.objects.create(
+                drug=drug, transaction_type='SALE', quantity=quantity,
+                selling_price=price
+            )
+
+    def export(self, export_format, **params):
+        response = self.client.get(
+            '/api/transactions/', {'format': export_format, **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_streams_every_filtered_row_oldest_first(self):
+        lines = self.export('csv', drug=self.drug.id).splitlines()
+        self.assertEqual(lines[0], 'id,drug,drug_sku,drug_name,transaction_type,'
+                                   'quantity,selling_price,time_created')
+        self.assertEqual(
+            [line.split(',')[5:7] for line in lines[1:]], [['2', '1.50'], ['4', '1.25']]
+        )
+
+    def test_ndjson_writes_one_object_per_line(self):
+        rows = [json.loads(line) for line in self.export('ndjson').splitlines()]
+        self.assertEqual(len(rows), Transaction.objects.count())
+        self.assertEqual([row['selling_price'] for row in rows], ['1.50', None, '1.25'])
+        self.assertEqual(rows[1]['drug_sku'], 'IBU')
+
+class OrderCreationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.supplier = Supplier.objects.create(
+            name='Acme', contact_person='Jane', telephone='123',
+            email='acme@example.com', address='1 Street'
+        )
+        cls.drugs = [create_drug(cls.category, f'D{number}') for number in range(10)]
+
+    def post_order(self, drugs, **fields):
+        return self.client.post('/api/orders/', {
+            'supplier': self.supplier.id,
+            'items': [
+                {'drug': drug.id, 'quantity': 5, 'purchase_price': '2.00'}
+                for drug in drugs
+            ],
+            **fields,
+        }, format='json')
+
+    def test_nested_items_are_written_in_one_batch(self):
+        counts = []
+        for drugs in (self.drugs[:2], self.drugs):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post_order(drugs)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(
+                [item['drug_sku'] for item in response.data['items']],
+                [drug.SKU for drug in drugs]
+            )
+            counts.append(len(app_queries(queries)))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_an_invalid_item_rejects_the_order(self):
+        response = self.client.post('/api/orders/', {
+            'supplier': self.supplier.id,
+            'items': [
+                {'drug': self.drugs[0].id, 'quantity': 5, 'purchase_price': '2.00'},
+                {'drug': 999999, 'quantity': 5, 'purchase_price': '2.00'},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data['items'][1]), ['drug'])
+        self.assertFalse(Order.objects.exists())
+
+    def test_order_created_received_is_booked_into_stock(self):
+        response = self.post_order(self.drugs[:2], status='RECEIVED')
+        self.assertEqual(response.data['status'], 'RECEIVED')
+        self.assertEqual(Inventory.objects.get(drug=self.drugs[0]).quantity, 105)
+
+class OrderReceiptTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        supplier = Supplier.objects.create(
+            name='Acme', contact_person='Jane', telephone='123',
+            email='acme@example.com', address='1 Street'
+        )
+        cls.first = create_drug(cls.category, 'ASP', quantity=0)
+        cls.second = create_drug(cls.category, 'IBU', quantity=0)
+        cls.order = Order.objects.create(supplier=supplier)
+        # Lines deliberately listed in descending drug order
+        cls.line = OrderItem.objects.create(
+            order=cls.order, drug=cls.second, quantity=4, purchase_price='3.00'
+        )
+        OrderItem.objects.create(
+            order=cls.order, drug=cls.first, quantity=6, purchase_price='1.00'
+        )
+
+    def receive(self):
+        return self.client.post(
+            f'/api/orders/{self.order.id}/update_status/', {'status': 'RECEIVED'}
+        )
+
+    def test_second_receipt_is_rejected_with_409(self):
+        self.assertEqual(self.receive().status_code, 200)
+        self.assertEqual(self.receive().status_code, 409)
+        self.assertEqual(Inventory.objects.get(drug=self.first).quantity, 6)
+        self.assertEqual(PriceHistory.objects.count(), 2)
+
+    def test_inventory_rows_are_locked_in_drug_order_before_the_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.order.receive()
+        inventory = [
+            query['sql'] for query in queries.captured_queries
+            if 'FROM "inventory_inventory"' in query['sql']
+            or query['sql'].startswith('UPDATE "inventory_inventory"')
+        ]
+        self.assertIn('ORDER BY "inventory_inventory"."drug_id" ASC', inventory[0])
+        self.assertTrue(inventory[-1].startswith('UPDATE'))
+
+    def test_lines_of_a_received_order_cannot_change(self):
+        self.order.receive()
+        url = f'/api/order-items/{self.line.id}/'
+        responses = [
+            self.client.post('/api/order-items/', {
+                'order': self.order.id, 'drug': self.first.id,
+                'quantity': 1, 'purchase_price': '1.00',
+            }, format='json'),
+            self.client.patch(url, {'quantity': 40}, format='json'),
+            self.client.delete(url),
+        ]
+        self.assertEqual([response.status_code for response in responses], [400] * 3)
+        self.assertEqual(self.order.items.count(), 2)
+        self.line.refresh_from_db()
+        self.assertEqual(self.line.quantity, 4)
+
+    def test_stale_reads_never_undo_a_receipt(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        self.order.receive()
+        received_at = Order.objects.get(pk=self.order.pk).received_at
+
+        serializer = OrderSerializer(stale, data={'status': 'PLACED'}, partial=True)
+        self.assertTrue(serializer.is_valid())
+        with self.assertRaises(serializers.ValidationError):
+            serializer.save()
+        serializer = OrderSerializer(stale, data={'status': 'RECEIVED'}, partial=True)
+        self.assertTrue(serializer.is_valid())
+        with self.assertRaises(OrderAlreadyReceivedError):
+            serializer.save()
+        with mock.patch.object(OrderViewSet, 'get_object', return_value=stale):
+            response = self.client.post(
+                f'/api/orders/{self.order.id}/update_status/', {'status': 'IN_PROGRESS'}
+            )
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(
+            Order.objects.filter(pk=self.order.pk).values_list('status', 'received_at').get(),
+            ('RECEIVED', received_at)
+        )
+        self.assertEqual(Inventory.objects.get(drug=self.first).quantity, 6)
+
+    def test_patching_the_status_to_received_books_stock_once(self):
+        url = f'/api/orders/{self.order.id}/'
+        self.assertEqual(self.client.patch(url, {'status': 'RECEIVED'}).status_code, 200)
+        self.assertEqual(self.client.patch(url, {'status': 'RECEIVED'}).status_code, 200)
+        self.assertEqual(self.client.patch(url, {'status': 'PLACED'}).status_code, 400)
+        self.assertEqual(Inventory.objects.get(drug=self.first).quantity, 6)
+
+class DrugSearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.paracetamol = create_drug(cls.category, 'PARA-500', name='Paracetamol 500mg')
+        cls.amoxicillin = create_drug(cls.category, 'AMOX-250', name='Amoxicillin')
+        cls.penicillin = create_drug(cls.category, 'PEN-V', name='Penicillin V')
+        cls.penicillin.description = (
+            'Narrow spectrum alternative to amoxicillin for adults and children'
+        )
+        cls.penicillin.save()
+
+    def search(self, text):
+        response = self.client.get('/api/drugs/', {'search': text})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    @skipUnless(connection.vendor == 'sqlite', "Exercises the FTS5 index")
+    def test_sqlite_matches_word_prefixes_of_every_term(self):
+        self.assertEqual(self.search('parac'), [self.paracetamol.id])
+        self.assertEqual(self.search('Para 500'), [self.paracetamol.id])
+        self.assertEqual(self.search('cetamol'), [])
+
+    @skipUnless(connection.vendor == 'sqlite', "Exercises the FTS5 index")
+    def test_sqlite_orders_by_bm25(self):
+        # Matched in name and SKU of a short row beats one description match
+        self.assertEqual(self.search('amox'), [self.amoxicillin.id, self.penicillin.id])
+
+    @skipUnless(connection.vendor == 'postgresql', "Exercises tsvector and pg_trgm")
+    def test_postgres_ranks_prefix_matches_and_tolerates_typos(self):
+        self.assertEqual(self.search('parac'), [self.paracetamol.id])
+        self.assertEqual(self.search('amox'), [self.amoxicillin.id, self.penicillin.id])
+        self.assertEqual(self.search('paracetmol'), [self.paracetamol.id])
+        self.assertEqual(self.search('amoxicilin'), [self.amoxicillin.id])
+
+class AutocompleteTests(APITestCase):
+    def autocomplete(self, prefix):
+        response = self.client.get('/api/drugs/autocomplete/', {'q': prefix})
+        return [row['SKU'] for row in response.data]
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    })
+    def test_committed_changes_patch_the_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            drug = create_drug(self.category, 'PARA-500', name='Paracetamol')
+        self.assertEqual(self.autocomplete('para'), ['PARA-500'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            drug.name = 'Acetaminophen'
+            drug.save()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.autocomplete('acet'), ['PARA-500'])
+        # Patched in place: only the stock of the match is read
+        self.assertEqual(len(app_queries(queries)), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Inventory.objects.filter(drug=drug).delete()
+            drug.delete()
+        self.assertEqual(self.autocomplete('acet'), [])
+
+    def test_rolled_back_drugs_never_reach_the_index(self):
+        self.autocomplete('z')
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                create_drug(self.category, 'ZEB', name='Zebra')
+                raise RuntimeError
+        self.assertEqual(self.autocomplete('zeb'), [])
+
+    def test_changes_from_other_processes_force_a_rebuild(self):
+        self.autocomplete('a')
+        # Another worker commits a drug in between
+        create_drug(self.category, 'ASP', name='Aspirin')
+        cache.incr(INDEX_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_drug(self.category, 'AMX', name='Amoxicillin')
+        self.assertEqual(sorted(self.autocomplete('a')), ['AMX', 'ASP'])
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                    'LOCATION': 'django_cache'}
+    })
+    def test_caches_without_an_atomic_incr_always_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            drug = create_drug(self.category, 'PARA-500', name='Paracetamol')
+        self.autocomplete('para')
+
+        # The project's DatabaseCache reads and then writes in incr()
+        with self.captureOnCommitCallbacks(execute=True):
+            drug.name = 'Acetaminophen'
+            drug.save()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.autocomplete('acet'), ['PARA-500'])
+        self.assertEqual(len(app_queries(queries)), 2)
+
+class MetricsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        create_drug(cls.category, 'ASP')
+
+    def recorded_queries(self, view_name):
+        series = QUERY_COUNT.series.get((view_name, 'GET'))
+        return series[-2] if series else 0
+
+    async def test_queries_on_worker_threads_are_counted(self):
+        client = AsyncClient(HTTP_HOST='localhost')
+        await client.aforce_login(self.user)
+        for url, view_name in (('/api/async/inventory/', 'async-inventory-list'),
+                               ('/api/inventory/', 'inventory-list')):
+            with self.subTest(view_name=view_name):
+                before = self.recorded_queries(view_name)
+                response = await client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertGreater(self.recorded_queries(view_name), before)
+
+    async def test_async_inventory_rejects_a_malformed_drug_filter(self):
+        client = AsyncClient(HTTP_HOST='localhost')
+        await client.aforce_login(self.user)
+        response = await client.get('/api/async/inventory/', {'drug': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+class DashboardTests(APITestCase):
+    def test_dashboard_figures(self):
+        supplier = Supplier.objects.create(
+            name='Acme', contact_person='Jane', telephone='123',
+            email='acme@example.com', address='1 Street'
+        )
+        aspirin = create_drug(self.category, 'ASP', quantity=10, reorder_level=2)
+        codeine = create_drug(self.category, 'COD', quantity=1, reorder_level=5)
+        for drug, prices in ((aspirin, ['1.00', '1.50']), (codeine, ['4.00'])):
+            for price in prices:
+                PriceHistory.objects.create(drug=drug, purchase_price=price)
+        Order.objects.create(supplier=supplier, status='DRAFT')
+        Order.objects.create(supplier=supplier, status='RECEIVED')
+        Transaction.objects.create(
+            drug=aspirin, transaction_type='SALE', quantity=3, selling_price='2.00'
+        )
+        Transaction.objects.create(drug=aspirin, transaction_type='USAGE', quantity=1)
+        Notifications.create_low_stock_alerts()
+
+        data = self.client.get('/api/dashboard/').data
+        self.assertEqual(data['total_stock_value'], '19.00')
+        self.assertEqual(data['low_stock_count'], 1)
+        self.assertEqual(
+            data['open_orders'], {'DRAFT': 1, 'PLACED': 0, 'IN_PROGRESS': 0}
+        )
+        self.assertEqual(data['sales_last_30_days'], {'revenue': '6.00', 'quantity': 3})
+        self.assertEqual(data['unread_notifications'], 1)
+
+    def test_only_one_caller_recomputes_while_others_get_the_stale_value(self):
+        compute = mock.Mock(return_value='fresh')
+        cache.set('figures', ('stale', time.time() - 1), 60)
+
+        cache.add('figures:lock', 1, 30)
+        self.assertEqual(get_or_recompute('figures', compute, 30), 'stale')
+        compute.assert_not_called()
+
+        cache.delete('figures:lock')
+        self.assertEqual(get_or_recompute('figures', compute, 30), 'fresh')
+        self.assertEqual(get_or_recompute('figures', compute, 30), 'fresh')
+        compute.assert_called_once()
+        self.assertIsNone(cache.get('figures:lock'))
+
+class StockAsOfTests(APITestCase):
+    def sell(self, drug, quantity):
+        response = self.client.post('/api/transactions/', {
+            'drug': drug.id, 'transaction_type': 'SALE', 'quantity': quantity,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_stock_is_replayed_from_the_nearest_snapshot(self):
+        drug = create_drug(self.category, 'ASP', quantity=10)
+        self.sell(drug, 4)
+        StockSnapshot.take()
+        between = now()
+        self.sell(drug, 1)
+
+        self.assertEqual(StockSnapshot.stock_as_of(between, [drug.id])[1], {drug.id: 6})
+        response = self.client.get(
+            '/api/inventory/as_of/', {'t': now().isoformat(), 'drug': drug.id}
+        )
+        self.assertEqual(response.data['results'], [{'drug': drug.id, 'quantity': 5}])
+
+    def test_malformed_drug_is_rejected(self):
+        response = self.client.get(
+            '/api/inventory/as_of/', {'t': now().isoformat(), 'drug': 'abc'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_impossible_moments_are_rejected(self):
+        for moment in ('2024-13-01T00:00:00', '2024-02-30T10:00', 'yesterday', ''):
+            with self.subTest(moment=moment):
+                response = self.client.get('/api/inventory/as_of/', {'t': moment})
+                self.assertEqual(response.status_code, 400)
+
+class MarginReportTests(APITestCase):
+    def test_each_sale_is_costed_at_the_price_in_effect(self):
+        drug = create_drug(self.category, 'ASP')
+        other = create_drug(self.category, 'IBU')
+
+        def sell(quantity, price):
+            Transaction.objects.create(
+                drug=drug, transaction_type='SALE', quantity=quantity,
+                selling_price=price
+            )
+
+        # Sold before any price was recorded: costed at the first price
+        sell(2, '3.00')
+        PriceHistory.objects.create(drug=drug, purchase_price='1.00')
+        PriceHistory.objects.create(drug=other, purchase_price='9.00')
+        sell(1, '3.00')
+        PriceHistory.objects.create(drug=drug, purchase_price='2.00')
+        sell(3, '4.00')
+        Transaction.objects.create(drug=drug, transaction_type='USAGE', quantity=5)
+
+        response = self.client.get(
+            '/api/transactions/margin/', {'drug': drug.id, 'period': 'day'}
+        )
+        self.assertEqual(len(response.data), 1)
+        row = response.data[0]
+        self.assertEqual(
+            (row['quantity'], row['revenue'], row['cost_of_goods'], row['margin']),
+            (6, '21.00', '9.00', '12.00')
+        )
+
+    def test_malformed_filters_are_rejected(self):
+        for params in ({'drug': 'abc'}, {'start_date': 'garbage'}, {'end_date': 'soon'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/transactions/margin/', params)
+                self.assertEqual(response.status_code, 400)
+
+class InventoryValuationTests(APITestCase):
+    def test_malformed_drug_is_rejected(self):
+        response = self.client.get('/api/inventory/valuation/', {'drug': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_incremental_figures_match_a_full_rebuild(self):
+        supplier = Supplier.objects.create(
+            name='Acme', contact_person='Jane', telephone='123',
+            email='acme@example.com', address='1 Street'
+        )
+        drugs = [create_drug(self.category, f'D{number}', quantity=0) for number in range(4)]
+        fields = ('drug', 'quantity', 'fifo_layers', 'fifo_value', 'average_cost',
+                  'average_value')
+
+        for seed in range(3):
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                for _ in range(150):
+                    if rng.random() < 0.4:
+                        order = Order.objects.create(supplier=supplier)
+                        OrderItem.objects.bulk_create([
+                            OrderItem(
+                                order=order, drug=drug, quantity=rng.randint(1, 20),
+                                purchase_price=Decimal(rng.randint(50, 999)) / 100,
+                                expiry_date=now().date() + timedelta(
+                                    days=rng.choice([-1, 30, 365])
+                                )
+                            )
+                            for drug in rng.sample(drugs, rng.randint(1, 2))
+                        ])
+                        order.receive()
+                    elif rng.random() < 0.15:
+                        StockLot.write_off_expired()
+                    else:
+                        self.client.post('/api/transactions/', {
+                            'drug': rng.choice(drugs).id, 'transaction_type': 'SALE',
+                            'quantity': rng.randint(1, 15),
+                        }, format='json')
+
+                incremental = list(
+                    InventoryValuation.objects.order_by('drug').values(*fields)
+                )
+                rebuild_valuations()
+                self.assertEqual(
+                    list(InventoryValuation.objects.order_by('drug').values(*fields)),
+                    incremental
+                )
+
+class ForecastTests(APITestCase):
+    def record_demand(self, drug, quantities, transaction_type='SALE'):
+        """DAY rollups for the days before today, oldest first."""
+        today = TransactionRollup.period_start_for(now(), 'DAY')
+        TransactionRollup.objects.bulk_create([
+            TransactionRollup(
+                drug=drug, transaction_type=transaction_type, granularity='DAY',
+                period_start=today - timedelta(days=len(quantities) - day),
+                quantity=quantity, count=1
+            )
+            for day, quantity in enumerate(quantities)
+        ])
+
+    def test_daily_demand_sums_sales_and_usage_from_the_day_rollups(self):
+        drug = create_drug(self.category, 'ASP')
+        self.record_demand(drug, [2, 0, 5])
+        self.record_demand(drug, [1, 1, 1], transaction_type='USAGE')
+        # Today's bucket is still filling up and stays out of the history
+        Transaction.objects.create(drug=drug, transaction_type='SALE', quantity=9)
+
+        drug_ids, demand = daily_demand(4)
+        self.assertEqual(drug_ids.tolist(), [drug.id])
+        self.assertEqual(demand.tolist(), [[0, 3, 1, 6]])
+
+    def test_moving_average_and_exponential_smoothing(self):
+        demand = np.array([[9.0, 1.0, 2.0, 3.0, 4.0], [5.0, 5.0, 5.0, 5.0, 5.0]])
+
+        expected, deviation = forecast(demand, 'moving_average', window=4)
+        self.assertEqual(expected.tolist(), [2.5, 5.0])
+        self.assertEqual(deviation.tolist(), [math.sqrt(1.25), 0.0])
+
+        # level 2 -> 3 -> 3, variance 0 -> 1 -> 0.5
+        expected, deviation = forecast(
+            np.array([[2.0, 4.0, 3.0]]), 'exponential', alpha=0.5
+        )
+        self.assertEqual(expected.tolist(), [3.0])
+        self.assertAlmostEqual(deviation[0], math.sqrt(0.5))
+
+    def test_reorder_levels_cover_lead_time_demand_plus_safety_stock(self):
+        steady = create_drug(self.category, 'ASP', reorder_level=10)
+        unchanged = create_drug(self.category, 'IBU', reorder_level=8)
+        idle = create_drug(self.category, 'COD', reorder_level=3)
+        self.record_demand(steady, [2, 4, 2, 4])
+        self.record_demand(unchanged, [2, 2, 2, 2])
+
+        recommendations = recommend_reorder_levels(
+            history_days=4, window=4, lead_time_days=4, service_level=0.95
+        )
+        z = NormalDist().inv_cdf(0.95)
+        self.assertEqual(
+            {row['drug']: row['proposed_reorder_level'] for row in recommendations},
+            # Mean 3 and deviation 1 over a four day lead time
+            {steady.id: math.ceil(3 * 4 + z * 1 * math.sqrt(4)), unchanged.id: 8}
+        )
+
+        self.assertEqual(apply_reorder_levels(recommendations), 1)
+        self.assertEqual(
+            dict(Inventory.objects.values_list('drug_id', 'reorder_level')),
+            {steady.id: 16, unchanged.id: 8, idle.id: 3}
+        )
+
+class ReplenishmentTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.acme, self.medco = [
+            Supplier.objects.create(
+                name=name, contact_person='Jane', telephone='123',
+                email=f'{name.lower()}@example.com', address='1 Street'
+            )
+            for name in ('Acme', 'Medco')
+        ]
+
+    def order(self, supplier, status, lines):
+        order = Order.objects.create(supplier=supplier, status=status)
+        for drug, quantity, price in lines:
+            OrderItem.objects.create(
+                order=order, drug=drug, quantity=quantity, purchase_price=price
+            )
+        return order
+
+    def drafted(self, orders):
+        return {
+            order.supplier_id: sorted(
+                order.items.values_list('drug_id', 'quantity', 'purchase_price')
+            )
+            for order in orders
+        }
+
+    def test_shortfalls_are_drafted_per_supplier_net_of_open_orders(self):
+        aspirin = create_drug(self.category, 'ASP', quantity=2, reorder_level=10)
+        codeine = create_drug(self.category, 'COD', quantity=4, reorder_level=5)
+        ibuprofen = create_drug(self.category, 'IBU', quantity=0, reorder_level=6)
+        stocked = create_drug(self.category, 'PAR', quantity=50, reorder_level=10)
+        novel = create_drug(self.category, 'NEW', quantity=0, reorder_level=3)
+        self.order(self.medco, 'RECEIVED', [(aspirin, 10, '0.80')])
+        # The most recent supplier and price win
+        self.order(self.acme, 'RECEIVED', [(aspirin, 10, '1.00'), (stocked, 5, '2.00')])
+        self.order(self.medco, 'RECEIVED', [(codeine, 10, '3.00')])
+        self.order(self.acme, 'PLACED', [(ibuprofen, 5, '1.50')])
+
+        orders, never_ordered = Order.create_replenishment_orders()
+
+        self.assertEqual(never_ordered, [novel.id])
+        self.assertTrue(all(order.status == 'DRAFT' for order in orders))
+        self.assertEqual(self.drafted(orders), {
+            self.acme.id: [
+                (aspirin.id, 18, Decimal('1.00')), (ibuprofen.id, 7, Decimal('1.50'))
+            ],
+            self.medco.id: [(codeine.id, 6, Decimal('3.00'))],
+        })
+
+    def test_a_second_run_drafts_nothing(self):
+        aspirin = create_drug(self.category, 'ASP', quantity=2, reorder_level=10)
+        self.order(self.acme, 'RECEIVED', [(aspirin, 10, '1.00')])
+
+        self.assertEqual(len(Order.create_replenishment_orders()[0]), 1)
+        self.assertEqual(Order.create_replenishment_orders(), ([], []))
+        self.assertEqual(Order.objects.filter(status='DRAFT').count(), 1)
+
+class StockLotTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.supplier = Supplier.objects.create(
+            name='Acme', contact_person='Jane', telephone='123',
+            email='acme@example.com', address='1 Street'
+        )
+        self.today = now().date()
+
+    def receive(self, lines):
+        """Receive one order line per (drug, units, price, days to expiry)."""
+        order = Order.objects.create(supplier=self.supplier)
+        for number, (drug, quantity, price, days) in enumerate(lines):
+            OrderItem.objects.create(
+                order=order, drug=drug, quantity=quantity, purchase_price=price,
+                lot_number=f'L{order.id}-{number}',
+                expiry_date=None if days is None else self.today + timedelta(days=days)
+            )
+        order.receive()
+        return {
+            lot.lot_number: lot
+            for lot in StockLot.objects.filter(order_item__order=order)
+        }
+
+    def sell(self, drug, quantity):
+        response = self.client.post('/api/transactions/', {
+            'drug': drug.id, 'transaction_type': 'SALE', 'quantity': quantity,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def remaining(self, lots):
+        return [
+            StockLot.objects.get(pk=lot.pk).quantity
+            for _, lot in sorted(lots.items())
+        ]
+
+    def test_sales_draw_the_earliest_expiry_first_and_undated_lots_last(self):
+        drug = create_drug(self.category, 'ASP', quantity=0)
+        lots = self.receive([
+            (drug, 5, '1.00', 60), (drug, 5, '1.00', None),
+            (drug, 5, '1.00', 10), (drug, 4, '1.00', -1),
+        ])
+
+        self.sell(drug, 7)
+        # The expired lot is left for the write-off
+        self.assertEqual(self.remaining(lots), [3, 5, 0, 4])
+        self.sell(drug, 5)
+        self.assertEqual(self.remaining(lots), [0, 3, 0, 4])
+
+    def test_expired_lots_are_written_off_once(self):
+        aspirin = create_drug(self.category, 'ASP', quantity=0)
+        codeine = create_drug(self.category, 'COD', quantity=0)
+        lots = self.receive([
+            (aspirin, 4, '2.00', -2), (aspirin, 6, '1.00', 90), (codeine, 3, '5.00', -1),
+        ])
+        Notifications.create_expiry_alerts()
+        Notifications.objects.update(is_read=True)
+
+        response = self.client.post(
+            '/api/inventory/write_off_expired/', {'drug': aspirin.id}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [(row['drug'], row['transaction_type'], row['quantity']) for row in response.data],
+            [(aspirin.id, 'WRITE_OFF', 4)]
+        )
+        self.assertEqual(self.remaining(lots), [0, 6, 3])
+        self.assertEqual(Inventory.objects.get(drug=aspirin).quantity, 6)
+        self.assertEqual(
+            InventoryValuation.objects.get(drug=aspirin).fifo_value, Decimal('6.00')
+        )
+        self.assertEqual(StockSnapshot.stock_as_of(now(), [aspirin.id])[1], {aspirin.id: 6})
+        self.assertEqual(
+            TransactionRollup.objects.get(
+                drug=aspirin, granularity='DAY', transaction_type='WRITE_OFF'
+            ).quantity,
+            4
+        )
+        # Only the codeine lot is still expired and in stock
+        self.assertEqual(
+            [alert.drug_id for alert in Notifications.create_expiry_alerts()], [codeine.id]
+        )
+
+        call_command('write_off_expired_lots', stdout=StringIO())
+        self.assertEqual(self.remaining(lots), [0, 6, 0])
+        self.assertEqual(Inventory.objects.get(drug=codeine).quantity, 0)
+        self.assertEqual(
+            self.client.post('/api/inventory/write_off_expired/').data, []
+        )
+
+        fields = ('drug', 'quantity', 'fifo_layers', 'average_cost')
+        valuations = list(InventoryValuation.objects.order_by('drug').values(*fields))
+        rebuild_valuations()
+        self.assertEqual(
+            list(InventoryValuation.objects.order_by('drug').values(*fields)), valuations
+        )
+
+    def assertRebuildMatches(self, drug):
+        fields = ('quantity', 'fifo_layers', 'fifo_value', 'average_cost', 'average_value')
+        incremental = InventoryValuation.objects.filter(drug=drug).values(*fields).get()
+        rebuild_valuations()
+        self.assertEqual(
+            InventoryValuation.objects.filter(drug=drug).values(*fields).get(), incremental
+        )
+
+    def test_write_offs_take_the_cost_layer_of_their_own_lot(self):
+        drug = create_drug(self.category, 'ASP', quantity=0)
+        kept = self.receive([(drug, 10, '5.00', 300)])
+        self.receive([(drug, 10, '1.00', -1)])
+
+        StockLot.write_off_expired()
+        valuation = InventoryValuation.objects.get(drug=drug)
+        self.assertEqual(valuation.fifo_value, Decimal('50.00'))
+        self.assertEqual(
+            valuation.fifo_layers, [[10, '5.00', next(iter(kept.values())).order_item_id]]
+        )
+        self.assertRebuildMatches(drug)
+
+    def test_write_offs_fall_back_to_the_oldest_layers(self):
+        drug = create_drug(self.category, 'ASP', quantity=0)
+        self.receive([(drug, 10, '1.00', -1)])
+        kept = self.receive([(drug, 10, '5.00', 300)])
+
+        # The sale draws on the dated lot but costs the older, expired layer,
+        # so half of the write-off is no longer in that layer
+        self.sell(drug, 5)
+        StockLot.write_off_expired()
+        self.assertEqual(self.remaining(kept), [5])
+        valuation = InventoryValuation.objects.get(drug=drug)
+        self.assertEqual(valuation.fifo_value, Decimal('25.00'))
+        self.assertEqual(
+            valuation.fifo_layers, [[5, '5.00', next(iter(kept.values())).order_item_id]]
+        )
+        self.assertRebuildMatches(drug)
+
+    def test_write_offs_cannot_be_posted_as_transactions(self):
+        drug = create_drug(self.category, 'ASP')
+        response = self.client.post('/api/transactions/', {
+            'drug': drug.id, 'transaction_type': 'WRITE_OFF', 'quantity': 1,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/inventory/write_off_expired/', {'drug': 'abc'}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/inventory/write_off_expired/', [drug.id], format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_expiring_soon_rejects_windows_out_of_range(self):
+        drug = create_drug(self.category, 'ASP', quantity=0)
+        self.receive([(drug, 5, '1.00', 10)])
+        for days in ('-1', '99999999', 'abc'):
+            with self.subTest(days=days):
+                response = self.client.get(f'/api/drugs/expiring_soon/?days={days}')
+                self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/drugs/expiring_soon/?days=10')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
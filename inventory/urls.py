@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 
 # Create a router and register our viewsets with it
 router = DefaultRouter()
@@ -18,16 +18,25 @@ router.register(r'notifications', views.NotificationsViewSet)
 
 # The API URLs are now determined automatically by the router
 urlpatterns = [
+    path('dashboard/', views.DashboardView.as_view(), name='dashboard'),
+    # Async read endpoints, served without a thread per request under ASGI
+    path('async/inventory/', async_views.inventory_list, name='async-inventory-list'),
+    path('async/inventory/low_stock/', async_views.low_stock, name='async-inventory-low-stock'),
+    path('async/inventory/<int:pk>/', async_views.inventory_detail, name='async-inventory-detail'),
+    path('async/notifications/unread/', async_views.unread_notifications, name='async-notifications-unread'),
+    path('async/dashboard/', async_views.dashboard, name='async-dashboard'),
     path('', include(router.urls)),
 ]
 
 # This will generate the following URL patterns:
 # API endpoints:
 # /drug-categories/
+# /drug-categories/tree/
 # /drug-categories/{id}/
 # /drug-categories/{id}/drugs/
 # /drugs/
 # /drugs/{id}/
+# /drugs/autocomplete/
 # /drugs/low_stock/
 # /drugs/expired/
 # /drugs/expiring_soon/
@@ -37,18 +46,34 @@ urlpatterns = [
 # /orders/
 # /orders/{id}/
 # /orders/recent/
+# /orders/replenish/
 # /orders/{id}/update_status/
 # /order-items/
 # /order-items/{id}/
 # /transactions/
 # /transactions/{id}/
 # /transactions/by_date_range/
+# /transactions/bulk/
+# /transactions/margin/
+# /transactions/timeseries/
 # /inventory/
 # /inventory/{id}/
 # /inventory/low_stock/
+# /inventory/as_of/
+# /inventory/valuation/
+# /inventory/reorder_preview/
+# /inventory/scan_low_stock/
+# /inventory/scan_expiry/
+# /inventory/write_off_expired/
 # /price-history/
 # /price-history/{id}/
 # /notifications/
 # /notifications/{id}/
 # /notifications/mark_all_as_read/
-# /notifications/{id}/mark_as_read/ 
\ No newline at end of file
+# /notifications/{id}/mark_as_read/
+# /dashboard/
+# /async/inventory/
+# /async/inventory/low_stock/
+# /async/inventory/{id}/
+# /async/notifications/unread/
+# /async/dashboard/ 
\ No newline at end of file
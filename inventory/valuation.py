@@ -0,0 +1,230 @@
+"""
+Full-ledger inventory valuation in NumPy.
+
+Receipts (received order lines) and consumption (transactions) of a batch
+of drugs are loaded as one stream of stock movements ordered by drug and
+time, and every drug of the batch is valued at once with array operations.
+The results follow the same rules as the per-movement updates made by
+InventoryValuation.receive(), consume() and write_off(): consumption takes
+the oldest layers first, a write-off first empties the layer of its own lot,
+and nothing takes stock below zero.
+"""
+from decimal import Decimal
+import numpy as np
+from django.db import models, transaction
+from django.db.models import F, Value
+from .models import Drug, Inventory, InventoryValuation, OrderItem, Transaction
+
+# Average costs are kept in ten-thousandths, the precision of
+# InventoryValuation.average_cost
+COST_SCALE = 10000
+
+def segment_starts(drugs):
+    """Index of the first element of each run of equal drug ids."""
+    return np.flatnonzero(np.r_[True, drugs[1:] != drugs[:-1]])
+
+def clipped_running_stock(drugs, deltas):
+    """
+    Stock after each movement when consumption cannot take stock below
+    zero. This is the running sum minus the lowest point it has reached,
+    computed per drug in one pass. Each drug's sums are shifted below every
+    earlier drug's, so the running minimum never crosses into another drug.
+    """
+    starts = segment_starts(drugs)
+    lengths = np.diff(np.r_[starts, len(drugs)])
+    totals = np.cumsum(deltas)
+    before = np.r_[0, totals[starts[1:] - 1]]
+    sums = totals - np.repeat(before, lengths)
+
+    span = int(np.abs(sums).max(initial=0)) * 2 + 1
+    shift = np.repeat(np.arange(len(starts), dtype=np.int64) * span, lengths)
+    lowest = np.minimum.accumulate(sums - shift) + shift
+    return sums - np.minimum(lowest, 0)
+
+def settle_write_offs(drugs, deltas, lines, receipts):
+    """
+    Movements with every write-off's units taken out of its own lot's
+    layer. Taking units a layer still holds is the same as shrinking that
+    layer from the start: those units outlived every earlier movement, so
+    nothing before the write-off changes, and only what the layer no longer
+    held is left as ordinary oldest-first consumption. Each pass settles
+    the write-offs of one rank per drug against the stream the earlier
+    passes left, as the average cost recurrence does with receipts.
+    """
+    settled = deltas.copy()
+    receipt_rows = np.flatnonzero(receipts)
+    targeted = np.flatnonzero(~receipts & (lines >= 0))
+    if not len(targeted) or not len(receipt_rows):
+        return settled
+
+    by_line = np.argsort(lines[receipt_rows], kind='stable')
+    receipt_lines = lines[receipt_rows][by_line]
+    found = np.minimum(
+        np.searchsorted(receipt_lines, lines[targeted]), len(receipt_lines) - 1
+    )
+    matched = receipt_lines[found] == lines[targeted]
+    targeted, layers = targeted[matched], receipt_rows[by_line[found[matched]]]
+    if not len(targeted):
+        return settled
+
+    first_rows = np.zeros(len(drugs), dtype=bool)
+    first_rows[segment_starts(drugs)] = True
+    targeted_starts = segment_starts(drugs[targeted])
+    lengths = np.diff(np.r_[targeted_starts, len(targeted)])
+    rank = np.arange(len(targeted)) - np.repeat(targeted_starts, lengths)
+    for current in range(int(rank.max()) + 1):
+        rows, own = targeted[rank == current], layers[rank == current]
+        stock = clipped_running_stock(drugs, settled)
+        before = np.where(first_rows[rows], 0, stock[rows - 1])
+        received = np.cumsum(np.where(receipts, settled, 0))
+        # What the lot's layer still holds under oldest-first consumption
+        held = np.clip(before - (received[rows] - received[own]), 0, settled[own])
+        taken = np.minimum(held, -settled[rows])
+        settled[own] -= taken
+        settled[rows] += taken
+    return settled
+
+def value_movements(drugs, deltas, costs, lines):
+    """
+    Value a stream of movements sorted by drug and time. ``deltas`` are
+    signed units (receipts positive) and ``costs`` hold the unit cost of
+    receipts and NaN for consumption. ``lines`` hold the order line id of
+    each receipt, the order line of the lot each write-off empties, and -1
+    for other consumption. Returns a dict of drug id -> figures.
+    """
+    if not len(drugs):
+        return {}
+    stock = clipped_running_stock(drugs, deltas)
+    starts = segment_starts(drugs)
+    ends = np.r_[starts[1:], len(drugs)] - 1
+    drug_ids = drugs[starts]
+    quantity = stock[ends]
+
+    receipts = ~np.isnan(costs)
+    receipt_drugs = drugs[receipts]
+    received = deltas[receipts]
+    receipt_costs = costs[receipts]
+    position = np.searchsorted(drug_ids, receipt_drugs)
+
+    # Weighted average: a receipt blends its cost with the stock already on
+    # hand. The recurrence runs once per receipt rank, across all drugs, in
+    # integer ten-thousandths rounded half to even after every receipt, the
+    # exact steps InventoryValuation.receive() takes with Decimal.quantize()
+    on_hand_before = stock[receipts] - received
+    receipt_cost_units = np.rint(receipt_costs * COST_SCALE).astype(np.int64)
+    receipt_starts = np.searchsorted(receipt_drugs, drug_ids)
+    rank = np.arange(len(receipt_drugs)) - receipt_starts[position]
+    average = np.zeros(len(drug_ids), dtype=np.int64)
+    for current in range(int(rank.max(initial=-1)) + 1):
+        # Empty order lines change nothing and would divide by zero
+        at_rank = (rank == current) & (received > 0)
+        index = position[at_rank]
+        before = on_hand_before[at_rank]
+        units = before + received[at_rank]
+        quotient, remainder = np.divmod(
+            before * average[index] + received[at_rank] * receipt_cost_units[at_rank],
+            units
+        )
+        twice = 2 * remainder
+        quotient += (twice > units) | ((twice == units) & (quotient % 2 == 1))
+        average[index] = quotient
+
+    # FIFO: once write-offs have shrunk their own layers, what is left is
+    # the newest layers that together cover the final quantity, the oldest
+    # of them possibly only in part
+    settled = settle_write_offs(drugs, deltas, lines, receipts)
+    layer_sizes = settled[receipts]
+    newer = np.zeros(len(layer_sizes), dtype=np.int64)
+    if len(layer_sizes):
+        reversed_drugs = receipt_drugs[::-1]
+        reversed_totals = np.cumsum(layer_sizes[::-1])
+        reversed_starts = segment_starts(reversed_drugs)
+        lengths = np.diff(np.r_[reversed_starts, len(layer_sizes)])
+        offsets = np.r_[0, reversed_totals[reversed_starts[1:] - 1]]
+        newer = (reversed_totals - np.repeat(offsets, lengths))[::-1] - layer_sizes
+    left = np.clip(quantity[position] - newer, 0, layer_sizes)
+
+    results = {}
+    for index, drug_id in enumerate(drug_ids.tolist()):
+        results[drug_id] = {
+            'quantity': int(quantity[index]),
+            'average_cost': Decimal(int(average[index])).scaleb(-4),
+            'layers': [],
+        }
+    kept = left > 0
+    for drug_id, units, cost, line in zip(
+        receipt_drugs[kept].tolist(), left[kept].tolist(),
+        receipt_costs[kept].tolist(), lines[receipts][kept].tolist()
+    ):
+        results[drug_id]['layers'].append([units, cost, line])
+    return results
+
+def ledger(drug_ids):
+    """Receipts and consumption of ``drug_ids`` as arrays sorted by drug and time."""
+    consumption = Transaction.objects.filter(drug_id__in=drug_ids).annotate(
+        moment=F('time_created'),
+        delta=-F('quantity'),
+        cost=Value(None, output_field=models.DecimalField()),
+        kind=Value(1),
+        line=F('lot__order_item')
+    )
+    receipts = OrderItem.objects.filter(
+        drug_id__in=drug_ids,
+        order__status='RECEIVED',
+        order__received_at__isnull=False
+    ).annotate(
+        moment=F('order__received_at'),
+        delta=F('quantity'),
+        cost=F('purchase_price'),
+        kind=Value(0),
+        line=F('id')
+    )
+    columns = ('drug_id', 'moment', 'delta', 'cost', 'kind', 'id', 'line')
+    # At equal times receipts go first, so they can cover the consumption;
+    # lines of one order stay in the order receive() books them
+    rows = list(
+        receipts.values_list(*columns)
+        .union(consumption.values_list(*columns), all=True)
+        .order_by('drug_id', 'moment', 'kind', 'id')
+    )
+    drugs = np.array([row[0] for row in rows], dtype=np.int64)
+    deltas = np.array([row[2] for row in rows], dtype=np.int64)
+    costs = np.array(
+        [np.nan if row[3] is None else float(row[3]) for row in rows],
+        dtype=np.float64
+    )
+    lines = np.array([-1 if row[6] is None else row[6] for row in rows], dtype=np.int64)
+    return drugs, deltas, costs, lines
+
+def rebuild_valuations(batch_size=500):
+    """
+    Recompute the valuation of every drug from the full ledger, a batch of
+    drugs at a time. Each batch holds its inventory rows locked, so no sale
+    or receipt can change the ledger between reading it and saving the
+    result. Returns the number of drugs valued.
+    """
+    drug_ids = list(Drug.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(drug_ids), batch_size):
+        batch = drug_ids[start:start + batch_size]
+        with transaction.atomic():
+            Inventory.lock_stock(batch)
+            results = value_movements(*ledger(batch))
+            valuations = []
+            for drug_id in batch:
+                figures = results.get(drug_id)
+                valuation = InventoryValuation(drug_id=drug_id)
+                if figures is not None:
+                    valuation.quantity = figures['quantity']
+                    valuation.average_cost = figures['average_cost']
+                    valuation.fifo_layers = [
+                        [units, f'{cost:.2f}', line] for units, cost, line in figures['layers']
+                    ]
+                valuation.set_figures()
+                valuations.append(valuation)
+            InventoryValuation.objects.bulk_create(
+                valuations,
+                update_conflicts=True,
+                unique_fields=['drug'],
+                update_fields=InventoryValuation.UPDATED_FIELDS
+            )
+    return len(drug_ids)
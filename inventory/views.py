@@ -1,47 +1,151 @@
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q
-from django.utils.timezone import now
-from datetime import timedelta
+from django.db import transaction as db_transaction
+from django.conf import settings
+from django.db.models import F, OuterRef, Prefetch, Subquery, Sum, Window
+from django.db.models.functions import RowNumber
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware, now
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from collections import Counter
 from .models import (
     DrugCategory, Drug, Supplier, Order, 
     OrderItem, Transaction, Inventory, 
-    PriceHistory, Notifications
+    PriceHistory, Notifications, InsufficientStockError,
+    OrderAlreadyReceivedError, TransactionRollup, StockSnapshot,
+    InventoryValuation, StockLot
 )
+from .autocomplete import drug_prefix_index
+from .cache import VersionedResponseCacheMixin
+from .categories import get_category_tree
+from .dashboard import get_dashboard
+from .exports import StreamingExportMixin
+from .forecasting import METHODS, recommend_reorder_levels
+from .pagination import TimeCreatedCursorPagination, CreatedAtCursorPagination
+from .reports import PERIODS, margin_report
+from .search import DrugSearchFilter
 from .serializers import (
     DrugCategorySerializer, DrugSerializer, SupplierSerializer,
     OrderSerializer, OrderItemSerializer, TransactionSerializer,
-    InventorySerializer, PriceHistorySerializer, NotificationsSerializer
+    InventorySerializer, PriceHistorySerializer, NotificationsSerializer,
+    TransactionRollupSeriesSerializer, MarginReportSerializer,
+    InventoryValuationSerializer, StockLotSerializer
 )
 
-class DrugCategoryViewSet(viewsets.ModelViewSet):
+def parse_moment(value):
+    """
+    Parse an ISO 8601 date or date and time query parameter into an aware
+    datetime, a bare date meaning its midnight. Returns None for anything
+    else.
+    """
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            moment = datetime.combine(day, time.min)
+    except ValueError:
+        return None
+    if is_naive(moment):
+        moment = make_aware(moment)
+    return moment
+
+def drug_queryset():
+    """
+    Drugs with category and inventory loaded, the latest
+    PRICE_HISTORY_PREVIEW_LIMIT prices per drug prefetched with one
+    window-function query, and the newest price annotated as current_price.
+    """
+    latest_prices = PriceHistory.objects.annotate(
+        row_number=Window(
+            RowNumber(),
+            partition_by=F('drug'),
+            order_by=[F('time_created').desc(), F('id').desc()]
+        )
+    ).filter(row_number__lte=settings.PRICE_HISTORY_PREVIEW_LIMIT)
+    current_price = PriceHistory.objects.filter(
+        drug=OuterRef('pk')
+    ).order_by('-time_created', '-id').values('purchase_price')[:1]
+    return Drug.objects.select_related('category', 'inventory').annotate(
+        current_price=Subquery(current_price)
+    ).prefetch_related(
+        Prefetch('price_history', queryset=latest_prices, to_attr='latest_prices')
+    )
+
+class DrugCategoryViewSet(VersionedResponseCacheMixin, viewsets.ModelViewSet):
     queryset = DrugCategory.objects.all()
+    cache_models = (DrugCategory,)
     serializer_class = DrugCategorySerializer
     filter_backends = [filters.SearchFilter]
     search_fields = ['name', 'description']
 
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        return Response(get_category_tree())
+
     @action(detail=True, methods=['get'])
     def drugs(self, request, pk=None):
         category = self.get_object()
-        drugs = Drug.objects.filter(category=category)
+        drugs = drug_queryset().filter(category=category)
         serializer = DrugSerializer(drugs, many=True)
         return Response(serializer.data)
 
-class DrugViewSet(viewsets.ModelViewSet):
+class DrugViewSet(VersionedResponseCacheMixin, viewsets.ModelViewSet):
     queryset = Drug.objects.all()
+    cache_models = (Drug, DrugCategory, Inventory, PriceHistory)
     serializer_class = DrugSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, DrugSearchFilter, filters.OrderingFilter]
     filterset_fields = ['category', 'dispense_unit']
     search_fields = ['name', 'SKU', 'description']
     ordering_fields = ['name', 'SKU']
 
     def get_queryset(self):
-        return Drug.objects.select_related('category').prefetch_related(
-            'inventory', 'price_history'
+        return drug_queryset()
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            return Response(
+                {"error": "limit must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(
+            drug_prefix_index.search(request.query_params.get('q', ''), limit)
         )
 
+    @action(detail=False, methods=['get'])
+    def expired(self, request):
+        return self.lots_response(StockLot.objects.expired())
+
+    @action(detail=False, methods=['get'])
+    def expiring_soon(self, request):
+        try:
+            days = int(request.query_params.get('days', settings.EXPIRY_WARNING_DAYS))
+        except ValueError:
+            return Response(
+                {"error": "days must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 0 <= days <= settings.EXPIRY_WINDOW_MAX_DAYS:
+            return Response(
+                {"error": f"days must be between 0 and {settings.EXPIRY_WINDOW_MAX_DAYS}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return self.lots_response(StockLot.objects.expiring_within(days))
+
+    def lots_response(self, lots):
+        lots = lots.select_related('drug').order_by('expiry_date', 'id')
+        page = self.paginate_queryset(lots)
+        serializer = StockLotSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
 class InventoryViewSet(viewsets.ModelViewSet):
     queryset = Inventory.objects.all()
     serializer_class = InventorySerializer
@@ -52,13 +156,140 @@ class InventoryViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def low_stock(self, request):
         low_stock = Inventory.objects.filter(
-            quantity__lte=Q(reorder_level)
+            quantity__lte=F('reorder_level')
         ).select_related('drug')
         serializer = self.get_serializer(low_stock, many=True)
         return Response(serializer.data)
 
-class SupplierViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def as_of(self, request):
+        moment = parse_moment(request.query_params.get('t', ''))
+        if moment is None:
+            return Response(
+                {"error": "t must be an ISO 8601 date or date and time"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        drug = request.query_params.get('drug')
+        try:
+            drug_ids = [int(drug)] if drug else None
+        except ValueError:
+            return Response(
+                {"error": "drug must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        taken_at, quantities = StockSnapshot.stock_as_of(moment, drug_ids)
+        return Response({
+            'as_of': moment,
+            'snapshot_taken_at': taken_at,
+            'results': [
+                {'drug': drug_id, 'quantity': quantity}
+                for drug_id, quantity in sorted(quantities.items())
+            ],
+        })
+
+    @action(detail=False, methods=['get'])
+    def valuation(self, request):
+        valuations = InventoryValuation.objects.order_by('drug_id')
+        drug = request.query_params.get('drug')
+        if drug:
+            try:
+                valuations = valuations.filter(drug=int(drug))
+            except ValueError:
+                return Response(
+                    {"error": "drug must be an integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        totals = valuations.aggregate(
+            fifo_value=Sum('fifo_value'), average_value=Sum('average_value')
+        )
+
+        page = self.paginate_queryset(valuations)
+        serializer = InventoryValuationSerializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        response.data['totals'] = {
+            method: str((value or Decimal('0')).quantize(Decimal('0.01')))
+            for method, value in totals.items()
+        }
+        return response
+
+    @action(detail=False, methods=['get'])
+    def reorder_preview(self, request):
+        params = request.query_params
+        method = params.get('method', 'moving_average')
+        if method not in METHODS:
+            return Response(
+                {"error": f"method must be one of: {', '.join(METHODS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            options = {
+                'history_days': int(params.get('history_days', 90)),
+                'window': int(params.get('window', 28)),
+                'alpha': float(params.get('alpha', 0.3)),
+                'lead_time_days': int(
+                    params.get('lead_time_days', settings.REORDER_LEAD_TIME_DAYS)
+                ),
+                'service_level': float(
+                    params.get('service_level', settings.REORDER_SERVICE_LEVEL)
+                ),
+            }
+        except ValueError:
+            return Response(
+                {"error": "history_days, window, alpha, lead_time_days and "
+                          "service_level must be numbers"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not (options['history_days'] > 0 and options['window'] > 0
+                and options['lead_time_days'] >= 0
+                and 0 < options['alpha'] <= 1 and 0 < options['service_level'] < 1):
+            return Response(
+                {"error": "history_days and window must be positive, "
+                          "lead_time_days not negative, alpha in (0, 1] and "
+                          "service_level in (0, 1)"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        recommendations = recommend_reorder_levels(method=method, **options)
+        page = self.paginate_queryset(recommendations)
+        return self.get_paginated_response(page)
+
+    @action(detail=False, methods=['post'])
+    def scan_low_stock(self, request):
+        alerts = Notifications.create_low_stock_alerts()
+        serializer = NotificationsSerializer(alerts, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def scan_expiry(self, request):
+        alerts = Notifications.create_expiry_alerts()
+        serializer = NotificationsSerializer(alerts, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def write_off_expired(self, request):
+        if not isinstance(request.data, dict):
+            return Response(
+                {"error": "the request body must be an object"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        lots = StockLot.objects.all()
+        drug = request.data.get('drug')
+        if drug:
+            try:
+                lots = lots.filter(drug=int(drug))
+            except (TypeError, ValueError):
+                return Response(
+                    {"error": "drug must be an integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        transactions = StockLot.write_off_expired(lots)
+        serializer = TransactionSerializer(transactions, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+class SupplierViewSet(VersionedResponseCacheMixin, viewsets.ModelViewSet):
     queryset = Supplier.objects.all()
+    cache_models = (Supplier,)
     serializer_class = SupplierSerializer
     filter_backends = [filters.SearchFilter]
     search_fields = ['name', 'contact_person', 'email', 'telephone']
@@ -70,9 +301,21 @@ class SupplierViewSet(viewsets.ModelViewSet):
         serializer = OrderSerializer(orders, many=True)
         return Response(serializer.data)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(StreamingExportMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    # One exported row per order line
+    export_columns = [
+        ('order_id', 'id'),
+        ('supplier', 'supplier_id'),
+        ('supplier_name', 'supplier__name'),
+        ('status', 'status'),
+        ('time_created', 'time_created'),
+        ('drug', 'items__drug_id'),
+        ('drug_sku', 'items__drug__SKU'),
+        ('quantity', 'items__quantity'),
+        ('purchase_price', 'items__purchase_price'),
+    ]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['supplier', 'status']
     ordering_fields = ['time_created']
@@ -80,6 +323,15 @@ class OrderViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Order.objects.select_related('supplier').prefetch_related('items__drug')
 
+    def update(self, request, *args, **kwargs):
+        try:
+            return super().update(request, *args, **kwargs)
+        except OrderAlreadyReceivedError as exc:
+            return Response(
+                {"error": str(exc)},
+                status=status.HTTP_409_CONFLICT
+            )
+
     @action(detail=False, methods=['get'])
     def recent(self, request):
         recent_orders = self.get_queryset().filter(
@@ -88,6 +340,16 @@ class OrderViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(recent_orders, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'])
+    def replenish(self, request):
+        orders, never_ordered = Order.create_replenishment_orders()
+        orders = self.get_queryset().filter(id__in=[order.id for order in orders])
+        serializer = self.get_serializer(orders, many=True)
+        return Response(
+            {'orders': serializer.data, 'never_ordered': never_ordered},
+            status=status.HTTP_201_CREATED
+        )
+
     @action(detail=True, methods=['post'])
     def update_status(self, request, pk=None):
         order = self.get_object()
@@ -97,9 +359,24 @@ class OrderViewSet(viewsets.ModelViewSet):
                 {"error": "Invalid status provided"},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        order.status = new_status
-        order.save()
-        serializer = self.get_serializer(order)
+        if new_status == 'RECEIVED':
+            try:
+                order.receive()
+            except OrderAlreadyReceivedError as exc:
+                return Response(
+                    {"error": str(exc)},
+                    status=status.HTTP_409_CONFLICT
+                )
+        # A conditional write, so a receipt committed since the order was
+        # read is never overwritten with a stale status
+        elif not Order.objects.filter(pk=order.pk).exclude(
+            status='RECEIVED'
+        ).update(status=new_status):
+            return Response(
+                {"error": "A received order cannot change status"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = self.get_serializer(self.get_object())
         return Response(serializer.data)
 
 class OrderItemViewSet(viewsets.ModelViewSet):
@@ -111,9 +388,31 @@ class OrderItemViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return OrderItem.objects.select_related('order', 'drug')
 
-class TransactionViewSet(viewsets.ModelViewSet):
+    def destroy(self, request, *args, **kwargs):
+        if self.get_object().order.status == 'RECEIVED':
+            return Response(
+                {"error": "Lines of a received order cannot be changed"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return super().destroy(request, *args, **kwargs)
+
+class TransactionViewSet(StreamingExportMixin, viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
+    export_columns = [
+        ('id', 'id'),
+        ('drug', 'drug_id'),
+        ('drug_sku', 'drug__SKU'),
+        ('drug_name', 'drug__name'),
+        ('transaction_type', 'transaction_type'),
+        ('quantity', 'quantity'),
+        ('selling_price', 'selling_price'),
+        ('time_created', 'time_created'),
+    ]
+    pagination_class = TimeCreatedCursorPagination
+    # Transactions are the stock ledger: editing or deleting one would leave
+    # stock, lots and valuation out of step with it
+    http_method_names = ['get', 'post', 'head', 'options']
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['drug', 'transaction_type']
     ordering_fields = ['time_created']
@@ -121,6 +420,25 @@ class TransactionViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Transaction.objects.select_related('drug')
 
+    def create(self, request, *args, **kwargs):
+        try:
+            return super().create(request, *args, **kwargs)
+        except InsufficientStockError as exc:
+            return Response(
+                {"error": str(exc), "shortages": exc.shortages},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+    def perform_create(self, serializer):
+        # UPDATE ... SET quantity = quantity - n WHERE quantity >= n, so
+        # concurrent sales of the same drug can never oversell or lose stock.
+        # Stock goes before save(), whose signal updates the rollups, so
+        # single and bulk sales both lock inventory first
+        with db_transaction.atomic():
+            data = serializer.validated_data
+            Inventory.decrement_stock({data['drug'].id: data['quantity']})
+            serializer.save()
+
     @action(detail=False, methods=['get'])
     def by_date_range(self, request):
         start_date = request.query_params.get('start_date')
@@ -135,11 +453,125 @@ class TransactionViewSet(viewsets.ModelViewSet):
         transactions = self.get_queryset().filter(
             time_created__range=[start_date, end_date]
         )
+        if self.is_export(request):
+            return self.export(request, transactions)
         serializer = self.get_serializer(transactions, many=True)
         return Response(serializer.data)
 
-class PriceHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+    @action(detail=False, methods=['get'])
+    def timeseries(self, request):
+        bucket = request.query_params.get('bucket', 'day').upper()
+        if bucket not in dict(TransactionRollup.GRANULARITIES):
+            return Response(
+                {"error": "bucket must be one of: hour, day"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        rollups = TransactionRollup.objects.filter(granularity=bucket)
+        drug = request.query_params.get('drug')
+        if drug:
+            try:
+                rollups = rollups.filter(drug=int(drug))
+            except ValueError:
+                return Response(
+                    {"error": "drug must be an integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        transaction_type = request.query_params.get('transaction_type')
+        if transaction_type:
+            rollups = rollups.filter(transaction_type=transaction_type)
+        for param, lookup in (('start_date', 'gte'), ('end_date', 'lte')):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            moment = parse_moment(value)
+            if moment is None:
+                return Response(
+                    {"error": f"{param} must be an ISO 8601 date or date and time"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            rollups = rollups.filter(**{f'period_start__{lookup}': moment})
+
+        series = rollups.values('period_start').annotate(
+            quantity=Sum('quantity'),
+            revenue=Sum('revenue'),
+            count=Sum('count')
+        ).order_by('period_start')
+        serializer = TransactionRollupSeriesSerializer(series, many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def margin(self, request):
+        period = request.query_params.get('period', 'month')
+        if period not in PERIODS:
+            return Response(
+                {"error": "period must be one of: day, week, month"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        transactions = Transaction.objects.all()
+        drug = request.query_params.get('drug')
+        if drug:
+            try:
+                transactions = transactions.filter(drug=int(drug))
+            except ValueError:
+                return Response(
+                    {"error": "drug must be an integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        for param, lookup in (('start_date', 'gte'), ('end_date', 'lte')):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            moment = parse_moment(value)
+            if moment is None:
+                return Response(
+                    {"error": f"{param} must be an ISO 8601 date or date and time"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            transactions = transactions.filter(**{f'time_created__{lookup}': moment})
+
+        serializer = MarginReportSerializer(
+            margin_report(transactions, period), many=True
+        )
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        quantities = Counter()
+        for item in serializer.validated_data:
+            quantities[item['drug'].id] += item['quantity']
+
+        try:
+            with db_transaction.atomic():
+                # Stock first: the rows are stamped only once its lock is
+                # held, so a snapshot taken meanwhile is never replayed past them
+                Inventory.decrement_stock(quantities)
+                transactions = Transaction.create_batch(
+                    [Transaction(**item) for item in serializer.validated_data]
+                )
+        except InsufficientStockError as exc:
+            return Response(
+                {"error": str(exc), "shortages": exc.shortages},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = self.get_serializer(transactions, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+class PriceHistoryViewSet(StreamingExportMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = PriceHistorySerializer
+    export_columns = [
+        ('id', 'id'),
+        ('drug', 'drug_id'),
+        ('drug_sku', 'drug__SKU'),
+        ('purchase_price', 'purchase_price'),
+        ('time_created', 'time_created'),
+    ]
+    pagination_class = TimeCreatedCursorPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['drug']
     ordering_fields = ['time_created']
@@ -150,6 +582,7 @@ class PriceHistoryViewSet(viewsets.ReadOnlyModelViewSet):
 class NotificationsViewSet(viewsets.ModelViewSet):
     queryset = Notifications.objects.all()
     serializer_class = NotificationsSerializer
+    pagination_class = CreatedAtCursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['is_read', 'notification_type']
     
@@ -167,3 +600,7 @@ class NotificationsViewSet(viewsets.ModelViewSet):
     def mark_all_as_read(self, request):
         self.get_queryset().filter(is_read=False).update(is_read=True)
         return Response({'status': 'all notifications marked as read'})
+
+class DashboardView(APIView):
+    def get(self, request):
+        return Response(get_dashboard())
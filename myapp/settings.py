@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",  # CORS middleware should be at the top
+    "inventory.metrics.MetricsMiddleware",  # Times everything below it
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -79,6 +80,8 @@ CORS_ALLOW_METHODS = [
 ]
 
 # Rest Framework settings
+# Page-number pagination for the catalog endpoints; the large append-only
+# endpoints override it with the cursor classes in inventory/pagination.py
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
@@ -101,6 +104,32 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Number of recent PriceHistory rows embedded in each DrugSerializer payload
+PRICE_HISTORY_PREVIEW_LIMIT = 5
+
+# Lifetime of cached catalog responses; model changes invalidate them sooner
+RESPONSE_CACHE_TIMEOUT = 60 * 15
+
+# Lifetime of the cached category tree. Writes delete it at once; the
+# timeout bounds how long a cache that missed the delete can serve it
+CATEGORY_TREE_CACHE_TIMEOUT = 60 * 15
+
+# Seconds the /api/dashboard/ figures may be served from cache
+DASHBOARD_CACHE_TIMEOUT = 30
+
+# Supplier lead time and service level behind the forecast reorder levels
+REORDER_LEAD_TIME_DAYS = 7
+REORDER_SERVICE_LEVEL = 0.95
+
+# Lots expiring within this many days are reported as expiring soon
+EXPIRY_WARNING_DAYS = 30
+
+# Longest window /api/drugs/expiring_soon/ accepts in ?days=
+EXPIRY_WINDOW_MAX_DAYS = 3650
+
+# Rows fetched per round trip by the streaming CSV/NDJSON exports
+EXPORT_CHUNK_SIZE = 2000
+
 ROOT_URLCONF = "myapp.urls"
 
 TEMPLATES = [
@@ -149,6 +178,24 @@ DATABASES = {
     }
 }
 
+# Cached responses, model version counters and recompute locks must be seen
+# by every worker process: Redis when REDIS_URL is set, otherwise a database
+# table created with `python manage.py createcachetable`
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -25,6 +25,7 @@ from rest_framework import permissions
 from django.views.generic import RedirectView
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from inventory.metrics import MetricsView
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -53,7 +54,8 @@ class APIRootView(APIView):
                     "swagger": "/swagger/",
                     "redoc": "/redoc/"
                 },
-                "health": "/health/"
+                "health": "/health/",
+                "metrics": "/metrics"
             }
         })
     
@@ -65,6 +67,7 @@ urlpatterns = [
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0)),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0)),
     path('health/', HealthCheckView.as_view(), name='health-check'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
 
 if settings.DEBUG: